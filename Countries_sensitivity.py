@@ -1,57 +1,61 @@
 # from dispatch_optimization import BusElectricity
-from dispatch_optimization import NetworkElectricity
+from dispatch_optimization import NetworkElectricity, ScenarioTemplate
+from sweep import run_adaptive_sweep
 import param
-import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 
 countries = param.countries
 technologies_by_country = param.technologies_by_country
-cost_HVAC_line = np.linspace(0, 200, 11)  # EUR/MW/km
+cost_HVAC_line_max = 200  # EUR/MW/km
+# Number of nearest neighbours each country is connected to, None for the
+# star around Paris (lines from France with the Distance_to_Paris lengths)
+meshed_neighbours = None
 
-# Dataframe to store the result
-df = pd.DataFrame()
-df_prices = pd.DataFrame()
-
-for cost_line in cost_HVAC_line:
+if __name__ == '__main__':
+    # The network is built once, only the cost of the lines changes between scenarios
     Europe_net = NetworkElectricity(param.year)
-    for country in countries:
-        print("Country: ", country)
-        Europe_net.add_country(
-            country, technologies=technologies_by_country[country])
-        if country != "FRA":
-            Europe_net.add_line("FRA", country, 0, 1, 1,
-                                cost_line*param.Distance_to_Paris[country], True)
-    Europe_net.optimize()
+    Europe_net.add_countries({country: technologies_by_country[country] for country in countries})
+    if meshed_neighbours is None:
+        for country in countries:
+            if country != "FRA":
+                Europe_net.add_line("FRA", country, 0, 1, 1, 0, True,
+                                    length=param.Distance_to_Paris[country])
+    else:
+        Europe_net.add_meshed_lines(k=meshed_neighbours)
+    template = ScenarioTemplate(Europe_net)
+    # The line costs are refined where the mix or the prices change
+    results = run_adaptive_sweep(template.scenario, 'line_cost', 0, cost_HVAC_line_max, budget=11)
+    cost_HVAC_line = np.sort(results.line_cost.unique())
     # Europe_net.plot_map()
 
-    production_mix = Europe_net.return_production_mix() / 1E6
-    df[cost_line] = production_mix.sum()
-
-    # Store marginal prices and global constraints in df_prices
-    marginal_prices = Europe_net.network.buses_t.marginal_price.mean()
-    global_constraints = -Europe_net.network.global_constraints.mu
-    df_prices[cost_line] = pd.concat([marginal_prices, global_constraints])
+    # Dataframes to store the result, production by carrier and prices by bus
+    df = results[results.quantity == 'carrier_production'].pivot(
+        index='name', columns='line_cost', values='value') / 1E6
+    df = df.loc[Europe_net.network.generators.carrier.unique()]
+    df_prices = results[results.quantity.isin(['price', 'co2_price'])].pivot(
+        index='name', columns='line_cost', values='value')
+    df_prices = df_prices.loc[[*Europe_net.network.buses.index, *Europe_net.network.global_constraints.index]]
 
-print(df)
-print(df_prices)
+    print(df)
+    print(df_prices)
 
 
-fig, ax1 = plt.subplots()
-ax1.stackplot(cost_HVAC_line, df,
-              labels=[generator for generator in df.index], alpha=0.9,
-              colors=[param.colors[generator] for generator in df.index])
-ax1.set(xlabel='Cost HVAC line (€/MW/km)', ylabel='Production (TWh)')
-ax1.legend(loc='upper right')
-ax1.grid(linewidth='0.4', linestyle='--')
-ax2 = ax1.twinx()
-for index, row in df_prices.iterrows():
-    ax2.plot(cost_HVAC_line, row, label=f'{index} price', marker='o')
-ax2.set(xlabel='Cost HVAC line (€/MW/km)', ylabel='Electricity price (€/MWh)')
-ax2.legend(loc='upper left')
-ax2.set(ylim=(40, 70))
-plt.show()
-print(df_prices)
+    fig, ax1 = plt.subplots()
+    ax1.stackplot(cost_HVAC_line, df,
+                  labels=[generator for generator in df.index], alpha=0.9,
+                  colors=[param.colors[generator] for generator in df.index])
+    ax1.set(xlabel='Cost HVAC line (€/MW/km)', ylabel='Production (TWh)')
+    ax1.legend(loc='upper right')
+    ax1.grid(linewidth='0.4', linestyle='--')
+    ax2 = ax1.twinx()
+    for index, row in df_prices.iterrows():
+        ax2.plot(cost_HVAC_line, row, label=f'{index} price', marker='o')
+    ax2.set(xlabel='Cost HVAC line (€/MW/km)', ylabel='Electricity price (€/MWh)')
+    ax2.legend(loc='upper left')
+    ax2.set(ylim=(40, 70))
+    plt.show()
+    print(df_prices)
 
 
 # Result
@@ -0,0 +1,484 @@
+import heapq
+import numpy as np
+import pandas as pd
+import pypsa
+import xarray as xr
+from pypsa.clustering.spatial import get_clustering_from_busmap
+import utils
+
+# Storage components linked between representative days: list name, level,
+# nominal attribute and initial level
+STORAGE = {'StorageUnit': ('storage_units', 'state_of_charge', 'p_nom', 'state_of_charge_initial'),
+           'Store': ('stores', 'e', 'e_nom', 'e_initial')}
+
+# Components whose time series are aggregated and disaggregated
+COMPONENTS = ['buses', 'generators', 'loads', 'storage_units', 'stores', 'links', 'lines', 'global_constraints']
+
+
+def _time_series(network: pypsa.Network, status: str):
+    """(list name, attribute, DataFrame) of the non-empty input or output time series"""
+    for component in network.iterate_components():
+        if component.list_name not in COMPONENTS:
+            continue
+        attrs = network.components[component.name].defaults
+        for attr, df in getattr(network, f'{component.list_name}_t').items():
+            is_output = attr in attrs.index and attrs.at[attr, 'status'] == 'Output'
+            if not df.empty and is_output == (status == 'Output'):
+                yield component.list_name, attr, df
+
+
+class TimeAggregation():
+    """
+    Reduce the hourly snapshots of a network before solving it, then map the
+    results back on the hourly snapshots. method is one of:
+    - 'uniform': snapshots of resolution hours
+    - 'segments': resolution consecutive segments of variable length, merged
+      where the time series change least
+    - 'kmeans' or 'kmedoids': resolution representative days, with the
+      cluster mean or the medoid day as representative
+    Uniform and segments keep the chronology, so storage state of charge is
+    linked between consecutive snapshots. With representative days, the level
+    of each storage runs hour by hour within each representative day from a
+    start level of its own, and add_constraints chains the days of the year
+    through the change of level of their representative day (Kotzur et al.,
+    2018), cyclic over the year or from the initial level of the storage. The
+    level of each day stays within the capacity given the lowest and highest
+    level of its representative day (standing losses within the day are
+    neglected in these bounds).
+    """
+
+    def __init__(self, method: str = 'uniform', resolution: int = 3, cyclic: bool = True, seed: int = 0):
+        if method not in ('uniform', 'segments', 'kmeans', 'kmedoids'):
+            raise ValueError(f'Unknown aggregation method {method}')
+        self.method = method
+        self.resolution = resolution
+        self.cyclic = cyclic  # Storage level at the end of the year equal to the start
+        self.seed = seed  # Of the k-means initialisation
+        self.assignment = None  # Aggregated snapshot of each hour
+        self.error = None
+
+    def __repr__(self):
+        return f'TimeAggregation({self.method!r}, {self.resolution}, cyclic={self.cyclic}, seed={self.seed})'
+
+    def cache_key(self) -> tuple:
+        """Method, resolution, cyclic storage and k-means seed, hashed by SolveCache"""
+        return ('TimeAggregation', self.method, self.resolution, self.cyclic, self.seed)
+
+    @property
+    def representative_days(self) -> bool:
+        return self.method in ('kmeans', 'kmedoids')
+
+    def _assign(self, X: np.ndarray):
+        """Aggregated snapshot of each hour and, for medoids, the hour that represents each snapshot"""
+        hours = len(X)
+        if self.method == 'uniform':
+            return np.arange(hours)//self.resolution, None
+        if self.method == 'segments':
+            return self._segments(X), None
+
+        days = X[:hours - hours % 24].reshape(-1, 24*X.shape[1])
+        if self.method == 'kmeans':
+            labels, _ = utils.kmeans(days, self.resolution, seed=self.seed)
+            representatives = None
+        else:
+            labels, medoids = utils.kmedoids(days, self.resolution, seed=self.seed)
+        # Representative days in chronological order of their first occurrence,
+        # clusters left empty are dropped
+        order = pd.unique(labels)
+        position = np.empty(self.resolution, dtype=int)
+        position[order] = np.arange(len(order))
+        assignment = (position[labels][:, None]*24 + np.arange(24)).ravel()
+        if self.method == 'kmedoids':
+            representatives = (medoids[order][:, None]*24 + np.arange(24)).ravel()
+        return assignment, representatives
+
+    def _segments(self, X: np.ndarray) -> np.ndarray:
+        """Merge adjacent hours (Ward criterion) until resolution segments are left"""
+        n = len(X)
+        count = np.ones(n)
+        total = X.astype(float).copy()
+        right = np.arange(1, n + 1)
+        left = np.arange(-1, n - 1)
+        alive = np.ones(n, dtype=bool)
+        version = np.zeros(n, dtype=int)
+
+        def cost(i, j):
+            difference = total[i]/count[i] - total[j]/count[j]
+            return count[i]*count[j]/(count[i] + count[j])*(difference @ difference)
+
+        heap = [(cost(i, i + 1), i, 0, 0) for i in range(n - 1)]
+        heapq.heapify(heap)
+        segments = n
+        while segments > self.resolution and heap:
+            _, i, version_i, version_j = heapq.heappop(heap)
+            j = right[i]
+            if not alive[i] or j >= n or version[i] != version_i or version[j] != version_j:
+                continue
+            # Merge segment j into segment i
+            count[i] += count[j]
+            total[i] += total[j]
+            alive[j] = False
+            right[i] = right[j]
+            if right[j] < n:
+                left[right[j]] = i
+            version[i] += 1
+            segments -= 1
+            if left[i] >= 0:
+                heapq.heappush(heap, (cost(left[i], i), left[i], version[left[i]], version[i]))
+            if right[i] < n:
+                heapq.heappush(heap, (cost(i, right[i]), i, version[i], version[right[i]]))
+        return np.cumsum(alive) - 1
+
+    def apply(self, network: pypsa.Network) -> pypsa.Network:
+        """Aggregated copy of network. The representation error of each input
+        time series (RMSE normalised by its maximum) is stored in self.error"""
+        inputs = list(_time_series(network, 'Input'))
+        X = np.hstack([df.to_numpy(dtype=float) for _, _, df in inputs])
+        scale = np.abs(X).max(axis=0)
+        scale[scale == 0] = 1
+        self.assignment, representatives = self._assign(X/scale)
+        counts = np.bincount(self.assignment)
+        first_hour = np.unique(self.assignment, return_index=True)[1]
+
+        aggregated = network.copy()
+        snapshots = network.snapshots[first_hour]
+        aggregated.set_snapshots(snapshots)
+        aggregated.snapshot_weightings.loc[:, :] = counts[:, None] * \
+            network.snapshot_weightings.to_numpy()[first_hour]
+        if self.representative_days:
+            # Storage runs hour by hour within each representative day, and
+            # the representative days are linked by add_constraints
+            aggregated.snapshot_weightings['stores'] = network.snapshot_weightings.stores.to_numpy()[first_hour]
+            aggregated.storage_units['cyclic_state_of_charge'] = True
+            aggregated.stores['e_cyclic'] = True
+        errors = {}
+        for list_name, attr, df in inputs:
+            values = df.to_numpy(dtype=float)
+            if representatives is None:
+                reduced = np.stack([np.bincount(self.assignment, weights=column)/counts for column in values.T], axis=1)
+            else:
+                reduced = values[representatives]
+            getattr(aggregated, f'{list_name}_t')[attr] = pd.DataFrame(reduced, index=snapshots, columns=df.columns)
+            rmse = np.sqrt(((reduced[self.assignment] - values)**2).mean(axis=0))
+            maximum = np.abs(values).max(axis=0)
+            for name, value, peak in zip(df.columns, rmse, maximum):
+                errors[(list_name, attr, name)] = value/peak if peak > 0 else 0.
+        self.error = pd.Series(errors, name='nrmse')
+        return aggregated
+
+    def add_constraints(self, aggregated: pypsa.Network):
+        """Link the storage level of the days of the year through their
+        representative day, on the model built for the aggregated network"""
+        if not self.representative_days:
+            return
+        m = aggregated.model
+        snapshots = aggregated.snapshots
+        periods = pd.RangeIndex(len(snapshots)//24, name='period')
+        days = pd.RangeIndex(len(self.assignment)//24 + 1, name='day')
+        day_period = self.assignment[::24]//24  # Representative day of each day of the year
+        first = xr.DataArray(np.arange(len(snapshots)) % 24 == 0, coords={'snapshot': snapshots})
+
+        def at(values, dim):
+            return xr.DataArray(np.asarray(values), dims=dim)
+
+        for component, (list_name, level_name, nominal, initial) in STORAGE.items():
+            assets = getattr(aggregated, list_name)
+            if assets.empty:
+                continue
+            level = m[f'{component}-{level_name}']
+            asset = level.dims[1]  # Dimension of the storage assets
+            names = assets.index.rename(asset)
+            hours = aggregated.snapshot_weightings.stores
+            decay = (1 - aggregated.get_switchable_as_dense(component, 'standing_loss')).pow(hours, axis=0)
+            decay_day = decay.groupby(np.arange(len(snapshots))//24).prod().to_numpy()
+
+            # Each representative day starts from its own level, not from the
+            # end of the representative day before it. The variables and
+            # constraints added here are not named after a component, so that
+            # pypsa does not map their solution on the network
+            start = m.add_variables(lower=0, coords=[periods, names], name=f'Aggregation-{component}-period_start')
+            start_hourly = start.isel(period=at(np.arange(len(snapshots))//24, 'snapshot'))
+            balance = m.constraints[f'{component}-energy_balance']
+            balance.update(lhs=balance.lhs + (xr.DataArray(decay.to_numpy(), coords=[snapshots, names])*first)
+                           * (start_hourly - level.roll(snapshot=1)))
+
+            # Lowest and highest level of each representative day, relative to its start
+            high = m.add_variables(lower=0, coords=[periods, names], name=f'Aggregation-{component}-period_max')
+            low = m.add_variables(upper=0, coords=[periods, names], name=f'Aggregation-{component}-period_min')
+            relative = level - start_hourly
+            m.add_constraints(relative - high.isel(period=at(np.arange(len(snapshots))//24, 'snapshot')) <= 0,
+                              name=f'Aggregation-{component}-period_max')
+            m.add_constraints(relative - low.isel(period=at(np.arange(len(snapshots))//24, 'snapshot')) >= 0,
+                              name=f'Aggregation-{component}-period_min')
+
+            # Level at the start of each day of the year, changed by the change
+            # of level of its representative day
+            day_start = m.add_variables(lower=0, coords=[days, names], name=f'Aggregation-{component}-day_start')
+            end = level.isel(snapshot=at(np.arange(23, len(snapshots), 24), 'period'))
+            change = (end - xr.DataArray(decay_day, coords=[periods, names])*start).isel(
+                period=at(day_period, 'transition'))
+            m.add_constraints(day_start.isel(day=at(days[1:], 'transition'))
+                              - xr.DataArray(decay_day[day_period], dims=['transition', asset])
+                              * day_start.isel(day=at(days[:-1], 'transition')) - change == 0,
+                              name=f'Aggregation-{component}-day_start')
+            if self.cyclic:
+                m.add_constraints(day_start.isel(day=-1) - day_start.isel(day=0) == 0,
+                                  name=f'Aggregation-{component}-day_start-cyclic')
+            else:
+                m.add_constraints(day_start.isel(day=0) == assets[initial].to_numpy(),
+                                  name=f'Aggregation-{component}-day_start-initial')
+
+            # The level of each day stays within the capacity
+            day_high = day_start.isel(day=at(days[:-1], 'transition')) + high.isel(period=at(day_period, 'transition'))
+            m.add_constraints(day_start.isel(day=at(days[:-1], 'transition'))
+                              + low.isel(period=at(day_period, 'transition')) >= 0,
+                              name=f'Aggregation-{component}-day_min')
+            extendable = assets[f'{nominal}_extendable']
+            capacity = assets[nominal]*(assets.max_hours if component == 'StorageUnit' else 1.)
+            fixed = names[~extendable.to_numpy()]
+            if len(fixed):
+                m.add_constraints(day_high.sel({asset: fixed}) <= capacity[fixed].to_numpy(),
+                                  name=f'Aggregation-{component}-fix-day_max')
+            ext = names[extendable.to_numpy()]
+            if len(ext):
+                size = m[f'{component}-{nominal}'].sel({asset: ext})
+                ratio = assets.max_hours[ext].to_numpy() if component == 'StorageUnit' else 1.
+                m.add_constraints(day_high.sel({asset: ext}) - ratio*size <= 0,
+                                  name=f'Aggregation-{component}-ext-day_max')
+
+    def disaggregate(self, aggregated: pypsa.Network, network: pypsa.Network):
+        """Write the results of the solved aggregated network on the hourly network"""
+        for component in aggregated.iterate_components():
+            if component.list_name not in COMPONENTS:
+                continue
+            static = getattr(aggregated, component.list_name)
+            attrs = network.components[component.name].defaults
+            outputs = static.columns.intersection(attrs.index[attrs.status == 'Output'])
+            getattr(network, component.list_name).loc[static.index, outputs] = static[outputs]
+        for list_name, attr, df in _time_series(aggregated, 'Output'):
+            getattr(network, f'{list_name}_t')[attr] = pd.DataFrame(
+                df.to_numpy()[self.assignment], index=network.snapshots, columns=df.columns)
+        if self.representative_days and aggregated.model is not None:
+            self._disaggregate_levels(aggregated, network)
+
+    def _disaggregate_levels(self, aggregated: pypsa.Network, network: pypsa.Network):
+        # Level of each hour of the year: start level of its day plus the
+        # change of level since the start of its representative day
+        m = aggregated.model
+        hours = len(self.assignment)
+        period = self.assignment//24
+        for component, (list_name, level_name, nominal, initial) in STORAGE.items():
+            if f'Aggregation-{component}-day_start' not in m.variables:
+                continue
+            level = getattr(aggregated, f'{list_name}_t')[level_name]
+            decay = (1 - aggregated.get_switchable_as_dense(component, 'standing_loss')).pow(
+                aggregated.snapshot_weightings.stores, axis=0).to_numpy()
+            elapsed_decay = pd.DataFrame(decay).groupby(np.arange(len(decay))//24).cumprod().to_numpy()
+            day_start = m[f'Aggregation-{component}-day_start'].solution.to_numpy()[np.arange(hours)//24]
+            start = m[f'Aggregation-{component}-period_start'].solution.to_numpy()[period]
+            values = (day_start - start)*elapsed_decay[self.assignment] + level.to_numpy()[self.assignment]
+            getattr(network, f'{list_name}_t')[level_name] = pd.DataFrame(
+                values, index=network.snapshots[:hours], columns=level.columns)
+
+
+class SpatialAggregation():
+    """
+    Reduce the buses of a network to regions before solving it, then map the
+    results back on the buses. Buses are clustered by k-means on features:
+    - 'coordinates': position of the buses
+    - 'profiles': daily load shape and daily capacity factor of each carrier
+    - 'both': coordinates and profiles, with the same weight
+    Loads are summed, generators and storage units of a carrier are merged in
+    each region, with averaged profiles and costs, and the lines between two
+    regions are merged. The regional results mapped back on the buses are an
+    approximation, not the nodal optimum: the capacity of a region is split
+    between its assets by available energy (p_nom_max times mean p_max_pu),
+    at most their p_nom_max, and the dispatch by the power available in each
+    snapshot; each bus gets the price of its region; the flow of merged lines
+    is split by capacity, and the lines inside a region carry the DC power
+    flow that balances each bus (NaN where the lines of the region do not
+    connect its buses).
+    """
+
+    # Merged components, by (bus, carrier)
+    one_ports = ('Load', 'StorageUnit')
+
+    def __init__(self, regions: int = 6, features: str = 'coordinates', seed: int = 0):
+        if features not in ('coordinates', 'profiles', 'both'):
+            raise ValueError(f'Unknown clustering features {features}')
+        self.regions = regions
+        self.features = features
+        self.seed = seed
+        self.busmap = None  # Region of each bus
+
+    def __repr__(self):
+        return f'SpatialAggregation({self.regions}, {self.features!r}, seed={self.seed})'
+
+    def cache_key(self) -> tuple:
+        """Number of regions, features and k-means seed, hashed by SolveCache"""
+        return ('SpatialAggregation', self.regions, self.features, self.seed)
+
+    def _features(self, network: pypsa.Network) -> np.ndarray:
+        buses = network.buses
+        blocks = []
+        if self.features in ('coordinates', 'both'):
+            # Equirectangular projection, in degrees of latitude
+            blocks.append(np.column_stack([buses.x*np.cos(np.radians(buses.y)), buses.y]))
+        if self.features in ('profiles', 'both'):
+            days = np.arange(len(network.snapshots))//24
+            load = network.loads_t.p_set.T.groupby(network.loads.bus).sum().T.reindex(columns=buses.index, fill_value=0.)
+            profiles = [(load/load.mean().where(load.mean() > 0, 1)).groupby(days).mean()]
+            p_max_pu = network.generators_t.p_max_pu
+            generators = network.generators.loc[p_max_pu.columns]
+            for carrier, names in generators.groupby('carrier').groups.items():
+                profile = p_max_pu[names].T.groupby(generators.bus[names]).mean().T
+                profiles.append(profile.reindex(columns=buses.index).groupby(days).mean().fillna(0.))
+            blocks.append(pd.concat(profiles).T.to_numpy())
+        # Standardized columns, each block with the same total weight
+        scaled = []
+        for block in blocks:
+            std = block.std(axis=0)
+            scaled.append((block - block.mean(axis=0))/np.where(std > 0, std, 1)/np.sqrt(block.shape[1]))
+        return np.hstack(scaled)
+
+    def apply(self, network: pypsa.Network) -> pypsa.Network:
+        """Copy of network with one bus per region"""
+        labels, _ = utils.kmeans(self._features(network), min(self.regions, len(network.buses)), seed=self.seed)
+        # Regions named after their bus with the largest demand
+        demand = network.loads_t.p_set.sum().groupby(network.loads.bus).sum().reindex(network.buses.index, fill_value=0.)
+        names = demand.groupby(labels).idxmax()
+        self.busmap = pd.Series(names[labels].to_numpy(), index=network.buses.index)
+        clustering = get_clustering_from_busmap(network, self.busmap, aggregate_generators_weighted=True,
+                                                aggregate_one_ports=set(self.one_ports))
+        self.linemap = clustering.linemap
+        aggregated = clustering.n
+        aggregated.add('Carrier', network.carriers.index, **network.carriers)
+        return aggregated
+
+    @staticmethod
+    def _fill(total: float, weight: np.ndarray, cap: np.ndarray) -> np.ndarray:
+        # Split total in proportion to weight, without going over cap: the
+        # excess of capped members goes to the others, again by weight
+        x = np.zeros(len(weight))
+        free = np.ones(len(weight), dtype=bool)
+        while total > 1e-9*max(abs(total), 1.) and free.any():
+            w = weight[free] if weight[free].sum() > 0 else np.ones(free.sum())
+            add = total*w/w.sum()
+            over = x[free] + add > cap[free]
+            if not over.any():
+                x[free] += add
+                break
+            capped = np.flatnonzero(free)[over]
+            total -= (cap[capped] - x[capped]).sum()
+            x[capped] = cap[capped]
+            free[capped] = False
+        return x
+
+    def _capacities(self, network: pypsa.Network, component: str, static: pd.DataFrame,
+                    total: np.ndarray) -> np.ndarray:
+        """Split of the optimal capacity total of the merged asset of each asset
+        in proportion to its available energy (p_nom_max times mean p_max_pu,
+        mean p_max_pu alone in groups with an unbounded asset), at most p_nom_max"""
+        mean_pu = network.get_switchable_as_dense(component, 'p_max_pu').mean().reindex(static.index).to_numpy()
+        cap = static.p_nom_max.to_numpy(dtype=float)
+        groups = pd.factorize(pd.MultiIndex.from_arrays([static.bus.map(self.busmap), static.carrier]))[0]
+        capacity = np.zeros(len(static))
+        for group in np.unique(groups):
+            members = np.flatnonzero(groups == group)
+            bounded = np.isfinite(cap[members]).all()
+            weight = mean_pu[members]*(cap[members] if bounded else 1.)
+            capacity[members] = self._fill(total[members[0]], weight, cap[members])
+        return capacity
+
+    def _intra_flows(self, network: pypsa.Network, residual: pd.DataFrame, lines: pd.Index) -> pd.DataFrame:
+        """DC power flow on the lines inside each region for the nodal residual
+        (injection minus flow on the lines between regions) of each snapshot,
+        NaN for regions whose own lines do not carry the residual"""
+        flows = pd.DataFrame(np.nan, index=network.snapshots, columns=lines)
+        static = network.lines.loc[lines]
+        for region, buses in self.busmap.groupby(self.busmap).groups.items():
+            inside = static.index[static.bus0.map(self.busmap).eq(region)]
+            if len(buses) < 2 or inside.empty:
+                continue
+            position = pd.Series(np.arange(len(buses)), index=buses)
+            incidence = np.zeros((len(buses), len(inside)))
+            incidence[position[static.bus0[inside]].to_numpy(), np.arange(len(inside))] = 1.
+            incidence[position[static.bus1[inside]].to_numpy(), np.arange(len(inside))] = -1.
+            susceptance = 1/static.x[inside].to_numpy()
+            laplacian = (incidence*susceptance) @ incidence.T
+            r = residual[buses].to_numpy().T
+            flow = susceptance[:, None]*(incidence.T @ (np.linalg.pinv(laplacian) @ r))
+            # Buses not connected by the lines of their region cannot be balanced
+            if np.allclose(incidence @ flow, r, atol=1e-6*max(np.abs(r).max(), 1.)):
+                flows[inside] = flow.T
+        return flows
+
+    def disaggregate(self, aggregated: pypsa.Network, network: pypsa.Network):
+        """Write the results of the solved regional network on the buses of network"""
+        for list_name, component in (('generators', 'Generator'), ('storage_units', 'StorageUnit')):
+            static = getattr(network, list_name)
+            if static.empty:
+                continue
+            merged = getattr(aggregated, list_name)
+            merged = pd.Series(merged.index, index=pd.MultiIndex.from_arrays([merged.bus, merged.carrier]))
+            source = merged.reindex(pd.MultiIndex.from_arrays([static.bus.map(self.busmap), static.carrier])).to_numpy()
+            total = getattr(aggregated, list_name).p_nom_opt.reindex(source).to_numpy()
+            static['p_nom_opt'] = self._capacities(network, component, static, total)
+            # Dispatch split by the power available in each snapshot, capacity by capacity
+            groups = [static.bus.map(self.busmap), static.carrier]
+            available = network.get_switchable_as_dense(component, 'p_max_pu')[static.index]*static.p_nom_opt
+            available_share = (available/available.T.groupby(groups).transform('sum').T).fillna(0.)
+            capacity_share = (static.p_nom_opt/static.p_nom_opt.groupby(groups).transform('sum')).fillna(0.)
+            for attr, df in getattr(aggregated, f'{list_name}_t').items():
+                if attr in ('p', 'p_dispatch', 'p_store', 'state_of_charge', 'spill') and not df.empty:
+                    share = capacity_share.to_numpy() if attr == 'state_of_charge' else available_share.to_numpy()
+                    getattr(network, f'{list_name}_t')[attr] = pd.DataFrame(
+                        df.reindex(columns=source, fill_value=0.).to_numpy()*share,
+                        index=network.snapshots, columns=static.index)
+
+        network.loads_t['p'] = network.loads_t.p_set.copy()
+        network.buses_t['marginal_price'] = pd.DataFrame(
+            aggregated.buses_t.marginal_price[self.busmap].to_numpy(), index=network.snapshots,
+            columns=network.buses.index)
+
+        lines = network.lines
+        if not lines.empty:
+            between = lines.index[lines.index.isin(self.linemap.index)]
+            merged = self.linemap[between]
+            capacity = lines.s_nom.where(~lines.s_nom_extendable, 1.)[between]
+            share = (capacity/capacity.groupby(merged).transform('sum')).to_numpy()
+            lines['s_nom_opt'] = lines.s_nom
+            lines.loc[between, 's_nom_opt'] = aggregated.lines.s_nom_opt[merged].to_numpy()*share
+            flow = pd.DataFrame(0., index=network.snapshots, columns=lines.index)
+            # Merged lines keep the orientation of the bus map
+            sign = np.where(lines.bus0[between].map(self.busmap).to_numpy()
+                            == aggregated.lines.bus0[merged].to_numpy(), 1., -1.)
+            flow[between] = aggregated.lines_t.p0[merged].to_numpy()*share*sign
+            # Lines inside the regions balance what is left at each bus
+            injection = pd.DataFrame(0., index=network.snapshots, columns=network.buses.index)
+            for list_name, direction in (('generators', 1.), ('storage_units', 1.), ('loads', -1.)):
+                p = getattr(network, f'{list_name}_t').p
+                if not p.empty:
+                    injection = injection.add(direction*p.T.groupby(getattr(network, list_name).bus[p.columns]).sum().T,
+                                              fill_value=0.)
+            outflow = flow[between].T.groupby(lines.bus0[between]).sum().T.reindex(
+                columns=network.buses.index, fill_value=0.) - flow[between].T.groupby(
+                lines.bus1[between]).sum().T.reindex(columns=network.buses.index, fill_value=0.)
+            inside = lines.index.difference(between)
+            if not inside.empty:
+                flow[inside] = self._intra_flows(network, injection - outflow, inside)
+            network.lines_t['p0'] = flow
+            network.lines_t['p1'] = -flow
+        network.global_constraints['mu'] = aggregated.global_constraints.mu.reindex(network.global_constraints.index)
+
+
+def aggregation_error(full, aggregated) -> pd.Series:
+    """Relative error of the objective and of the capacity of each carrier of a
+    model (BusElectricity or NetworkElectricity) solved with time aggregation,
+    against the full resolution solve"""
+    def capacities(network):
+        return pd.concat([network.generators.groupby('carrier').p_nom_opt.sum(),
+                          network.storage_units.groupby('carrier').p_nom_opt.sum()])
+    reference = pd.concat([pd.Series({'objective': full.objective}), capacities(full.network)])
+    approximation = pd.concat([pd.Series({'objective': aggregated.objective}), capacities(aggregated.network)])
+    return (approximation - reference)/reference.abs().where(reference != 0)
@@ -0,0 +1,256 @@
+"""
+Benchmarks of the network build and solve paths.
+
+    python benchmark.py                       # run every case, compare with the baseline
+    python benchmark.py --cases solve_week    # run some cases only
+    python benchmark.py --save-baseline       # store the results as the new baseline
+
+Each case runs in a fresh process, so that import times and peak memory are
+not affected by the other cases, and is repeated --repeat times keeping the
+fastest run. Times and peak memory more than --tolerance above the baseline
+are flagged as regressions (exit code 1), changes of the LP size are flagged
+as well. The model_cache case fails if a patched cached model (see
+solve_cache.ModelCache.verify) solves differently from a fresh one. Baselines depend on the machine, so none is committed: without a
+baseline for the cases run, the script stops with exit code 2 unless
+--save-baseline is given.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import pandas as pd
+
+BASELINE_PATH = 'benchmarks/baseline.json'
+YEAR = 2015
+TIME_METRICS = ['import_time', 'build_time', 'model_time', 'solve_time', 'peak_rss']
+SIZE_METRICS = ['rows', 'cols', 'nnz']
+
+CASES = {}
+
+
+def case(name):
+    def register(function):
+        CASES[name] = function
+        return function
+    return register
+
+
+def _lp_size(model) -> dict:
+    return {'rows': model.ncons, 'cols': model.nvars, 'nnz': model.matrices.A.nnz}
+
+
+def _bus(storage: bool = False):
+    from dispatch_optimization import BusElectricity
+    import param
+    storage_technologies = param.technologies_storage_france if storage else None
+    return BusElectricity('FRA', YEAR, technologies=param.technologies_france,
+                          storage_technologies=storage_technologies)
+
+
+@case('param_import')
+def param_import():
+    start = time.perf_counter()
+    import param  # noqa: F401
+    return {'import_time': time.perf_counter() - start}
+
+
+@case('bus')
+def bus():
+    start = time.perf_counter()
+    _bus()
+    return {'build_time': time.perf_counter() - start}
+
+
+@case('bus_storage')
+def bus_storage():
+    start = time.perf_counter()
+    _bus(storage=True)
+    return {'build_time': time.perf_counter() - start}
+
+
+def _network(n_countries: int):
+    from dispatch_optimization import NetworkElectricity
+    import param
+    start = time.perf_counter()
+    network = NetworkElectricity(YEAR)
+    for country in param.countries[:n_countries]:
+        network.add_country(country, technologies=param.technologies_by_country[country])
+    return {'build_time': time.perf_counter() - start}
+
+
+for _n in (1, 3, 6):
+    case(f'network_{_n}')(lambda n=_n: _network(n))
+
+
+@case('network_bulk_6')
+def network_bulk_6():
+    from dispatch_optimization import NetworkElectricity
+    import param
+    start = time.perf_counter()
+    network = NetworkElectricity(YEAR)
+    network.add_countries({country: param.technologies_by_country[country] for country in param.countries})
+    return {'build_time': time.perf_counter() - start}
+
+
+def _meshed(n_countries: int, regions: int = None):
+    from dispatch_optimization import NetworkElectricity
+    from aggregation import SpatialAggregation
+    from solver import SolverConfig
+    import param
+    start = time.perf_counter()
+    network = NetworkElectricity(YEAR, aggregation=SpatialAggregation(regions) if regions else None)
+    network.add_countries({country: param.technologies_by_country[country]
+                           for country in list(param.country_coords)[:n_countries]})
+    network.add_meshed_lines(k=3, line_cost=100.)
+    build_time = time.perf_counter() - start
+    network.network.set_snapshots(network.network.snapshots[:168])
+    network.optimize(solver=SolverConfig())
+    durations = network.run_log.durations()
+    metrics = {'build_time': build_time, 'model_time': durations['model'], 'solve_time': durations['solve']}
+    # The model of a spatially aggregated network is not kept
+    if network.network.model is not None:
+        metrics.update(_lp_size(network.network.model))
+    return metrics
+
+
+for _n in (6, 15, 31):
+    case(f'meshed_{_n}')(lambda n=_n: _meshed(n))
+case('meshed_31_regions_6')(lambda: _meshed(31, regions=6))
+
+
+@case('hydrogen_sector')
+def hydrogen_sector():
+    import param
+    model = _bus(storage=True)
+    demand = param.hourly_hydrogen_demand
+    start = time.perf_counter()
+    model.add_sector('Hydrogen', demand, storage=True, bidirectional=True)
+    return {'build_time': time.perf_counter() - start}
+
+
+def _solve(hours: int):
+    from solver import SolverConfig
+    start = time.perf_counter()
+    model = _bus()
+    model.network.set_snapshots(model.network.snapshots[:hours])
+    build_time = time.perf_counter() - start
+    model.optimize(solver=SolverConfig())
+    durations = model.run_log.durations()
+    return {'build_time': build_time, 'model_time': durations['model'], 'solve_time': durations['solve'],
+            **_lp_size(model.network.model)}
+
+
+for _name, _hours in (('solve_week', 168), ('solve_month', 720), ('solve_year', 8760)):
+    case(_name)(lambda hours=_hours: _solve(hours))
+
+
+@case('model_cache')
+def model_cache():
+    # Fails if a patched cached model no longer solves the LP of a fresh build
+    import tempfile
+    from solve_cache import ModelCache
+    model = _bus()
+    model.network.set_snapshots(model.network.snapshots[:168])
+    model.add_co2_constraints(1e6)
+    cache = ModelCache(tempfile.mkdtemp())
+    cache.create_model(model.network.copy())
+    network = model.network
+    network.generators['capital_cost'] *= 1.3
+    network.generators['marginal_cost'] *= 0.8
+    network.loads_t.p_set *= 1.05
+    network.generators_t.p_max_pu *= 0.9
+    network.global_constraints['constant'] = 5e5
+    start = time.perf_counter()
+    cache.create_model(network.copy())
+    model_time = time.perf_counter() - start
+    cache.verify(network)
+    return {'model_time': model_time}
+
+
+def _run_case(name: str) -> dict:
+    from instrumentation import peak_rss
+    metrics = CASES[name]()
+    metrics['peak_rss'] = peak_rss()
+    return metrics
+
+
+def run(cases, repeat: int = 3) -> pd.DataFrame:
+    """Metrics of each case, one row per case: times in seconds, peak_rss in
+    MB, LP size. The fastest of repeat runs is kept."""
+    context = multiprocessing.get_context('spawn')
+    rows = {}
+    for name in cases:
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                runs.append(executor.submit(_run_case, name).result())
+        rows[name] = pd.DataFrame(runs).min()
+        print(f'{name}: ' + ', '.join(f'{metric}={value:.4g}' for metric, value in rows[name].items()), flush=True)
+    return pd.DataFrame(rows).T.reindex(columns=[m for m in TIME_METRICS + SIZE_METRICS
+                                                 if any(m in row for row in rows.values())])
+
+
+def compare(results: pd.DataFrame, baseline: dict, tolerance: float = 0.2) -> pd.DataFrame:
+    """Tidy comparison (case, metric, value, baseline, ratio, regression) with the baseline"""
+    rows = []
+    for name, metrics in results.iterrows():
+        for metric, value in metrics.dropna().items():
+            reference = baseline.get(name, {}).get(metric)
+            ratio = value/reference if reference else float('nan')
+            if metric in SIZE_METRICS:
+                regression = reference is not None and value != reference
+            else:
+                regression = reference is not None and ratio > 1 + tolerance
+            rows.append({'case': name, 'metric': metric, 'value': value, 'baseline': reference,
+                         'ratio': ratio, 'regression': regression})
+    return pd.DataFrame(rows)
+
+
+def load_baseline(path: str = BASELINE_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(results: pd.DataFrame, path: str = BASELINE_PATH):
+    """Merge results in the baseline at path, replacing the cases that were run"""
+    baseline = load_baseline(path)
+    for name, metrics in results.iterrows():
+        baseline[name] = metrics.dropna().to_dict()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark network build and solve paths')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative slow-down flagged as regression')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--output', help='CSV file for the comparison table')
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline)
+    missing = [name for name in args.cases if name not in baseline]
+    if missing and not args.save_baseline:
+        print(f'No baseline in {args.baseline} for: {", ".join(missing)}. '
+              'Run with --save-baseline first to record one.', file=sys.stderr)
+        sys.exit(2)
+
+    results = run(args.cases, args.repeat)
+    comparison = compare(results, baseline, args.tolerance)
+    with pd.option_context('display.max_rows', None, 'display.width', 120):
+        print(comparison)
+    if args.output:
+        comparison.to_csv(args.output, index=False)
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+    elif comparison.regression.any():
+        print('Regressions:', ', '.join(comparison[comparison.regression].case.unique()))
+        sys.exit(1)
@@ -0,0 +1,129 @@
+import dataclasses
+import multiprocessing
+import linopy
+import numpy as np
+import pandas as pd
+from solver import SolverConfig
+from sweep import worker_build, worker_count, worker_pool
+
+# Capacity planning robust across weather years by Benders decomposition. The
+# master problem chooses the capacity of every extendable generator and
+# storage unit and an estimate of the operational cost of each year; each
+# weather year is a dispatch subproblem with the capacities fixed, which
+# returns its operational cost and the derivative of this cost with respect
+# to the capacities (an optimality cut). Subproblems run in worker processes,
+# each holding one model at a time.
+
+# Table of the components whose capacity is chosen by the master problem
+COMPONENTS = {'Generator': 'generators', 'StorageUnit': 'storage_units'}
+
+def _subproblem(year, capacities: pd.DataFrame, voll: float, solver: SolverConfig):
+    """Operational cost of year with the given capacities (index component,
+    name) and its gradient with respect to them"""
+    model = worker_build()(year)
+    network = model.network
+    for component, table in COMPONENTS.items():
+        static = getattr(network, table)
+        fixed = capacities.loc[component].capacity if component in capacities.index else pd.Series(dtype=float)
+        static.loc[fixed.index, 'p_nom_min'] = fixed
+        static.loc[fixed.index, 'p_nom_max'] = fixed
+        static.loc[fixed.index, 'capital_cost'] = 0.
+    # Load shedding keeps every subproblem feasible
+    for bus, load in network.loads.groupby('bus').groups.items():
+        network.add('Generator', f'{bus} load shedding', bus=bus, carrier='load shedding',
+                    p_nom=network.loads_t.p_set[load].sum(axis=1).max(), marginal_cost=voll)
+    model.optimize(solver=solver)
+    if model.solve_stats['status'] != 'ok':
+        raise RuntimeError(f'Subproblem {year} failed: {model.solve_stats["condition"]}')
+
+    # The capacity bounds are the constraints p_nom >= p_nom_min and
+    # p_nom <= p_nom_max, both with the fixed capacity as right-hand side
+    constraints = network.model.constraints
+    gradient = pd.Series(0., index=capacities.index)
+    for component in capacities.index.unique('component'):
+        for bound in ('lower', 'upper'):
+            name = f'{component}-ext-p_nom-{bound}'
+            if name in constraints:
+                dual = constraints[name].dual.to_pandas()
+                dual.index = pd.MultiIndex.from_product([[component], dual.index])
+                gradient = gradient.add(dual.reindex(capacities.index, fill_value=0.))
+    return network.objective, gradient
+
+
+class BendersDecomposition():
+    """
+    Capacity mix minimizing the capital cost plus the mean operational cost
+    over weather years. build(year) returns the BusElectricity (or
+    NetworkElectricity) of a weather year; the extendable generators and
+    storage units of years[0] give the capital costs and capacity bounds.
+    Unserved demand costs voll EUR/MWh in the subproblems. Iterations stop
+    when the relative gap between the lower bound (master problem) and the
+    upper bound (best capacity mix evaluated on every year) is under tolerance.
+    """
+
+    def __init__(self, build, years, workers: int = None, solver: SolverConfig = None, solver_threads: int = 1,
+                 voll: float = 10000., tolerance: float = 1e-3, max_iterations: int = 50):
+        self.build = build
+        self.years = list(years)
+        self.workers = worker_count(workers, solver_threads, len(self.years))
+        self.solver = dataclasses.replace(solver or SolverConfig(), threads=solver_threads)
+        self.voll = voll
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self.capacities = None  # Best capacity mix found, in MW
+        self.history = None  # Bounds of each iteration
+
+    def _assets(self) -> pd.DataFrame:
+        network = self.build(self.years[0]).network
+        tables = []
+        for component, table in COMPONENTS.items():
+            static = getattr(network, table)
+            static = static[static.p_nom_extendable]
+            tables.append(pd.DataFrame({'capital_cost': static.capital_cost, 'p_nom_min': static.p_nom_min,
+                                        'p_nom_max': static.p_nom_max}).set_index(
+                pd.MultiIndex.from_product([[component], static.index], names=['component', 'name'])))
+        return pd.concat(tables)
+
+    def _master(self, assets: pd.DataFrame):
+        model = linopy.Model()
+        index = pd.Index(range(len(assets)), name='asset')
+        capacity = model.add_variables(lower=pd.Series(assets.p_nom_min.to_numpy(), index=index),
+                                       upper=pd.Series(assets.p_nom_max.to_numpy(), index=index), name='p_nom')
+        # Operational costs are non-negative, which bounds the first master problem
+        cost = model.add_variables(lower=0, coords=[pd.Index(self.years, name='year')], name='operational_cost')
+        model.add_objective((capacity*pd.Series(assets.capital_cost.to_numpy(), index=index)).sum()
+                            + cost.sum()/len(self.years))
+        return model, capacity, cost
+
+    def run(self) -> pd.Series:
+        """Solve the decomposition and return the capacity of each asset (MW)"""
+        assets = self._assets()
+        master, capacity, cost = self._master(assets)
+        capital_cost = assets.capital_cost.to_numpy()
+        upper_bound = np.inf
+        history = []
+        # Workers are started after the first master solve, and forking a
+        # process whose solver threads are running can deadlock
+        with worker_pool(self.build, self.workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            for iteration in range(self.max_iterations):
+                master.solve(solver_name=self.solver.backend, **self.solver.solver_options())
+                x = capacity.solution.to_numpy()
+                lower_bound = master.objective.value
+                capacities = pd.DataFrame({'capacity': x}, index=assets.index)
+                results = list(executor.map(_subproblem, self.years, [capacities]*len(self.years),
+                                            [self.voll]*len(self.years), [self.solver]*len(self.years)))
+                objective = capital_cost @ x + np.mean([value for value, _ in results])
+                if objective < upper_bound:
+                    upper_bound = objective
+                    self.capacities = capacities.capacity
+                gap = (upper_bound - lower_bound)/abs(upper_bound)
+                history.append({'iteration': iteration, 'lower_bound': lower_bound,
+                                'upper_bound': upper_bound, 'gap': gap})
+                if gap < self.tolerance:
+                    break
+                for year, (value, gradient) in zip(self.years, results):
+                    g = pd.Series(gradient.to_numpy(), index=capacity.indexes['asset'])
+                    master.add_constraints(cost.loc[year] - (capacity*g).sum() >= value - g.to_numpy() @ x,
+                                           name=f'cut_{iteration}_{year}')
+        self.history = pd.DataFrame(history).set_index('iteration')
+        return self.capacities
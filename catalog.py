@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import utils
+
+
+class CostCatalog():
+    """
+    Network parameters of every technology of the cost tables, computed for
+    the whole table at once:
+    - generators: capital_cost (annualized CAPEX and FOM, EUR/MW/year),
+      marginal_cost (VOM and fuel, EUR/MWh), efficiency, co2_emissions
+    - storage: capital_cost (annualized power and energy CAPEX and FOM,
+      EUR/MW/year), marginal_cost (EUR/MWh), efficiency, max_hours,
+      p_nom_max (MW, inf when the table gives no binding limit), co2_emissions
+    """
+
+    # Storage with a larger max capacity (MW) is not limited
+    unlimited_capacity = 500000
+
+    def __init__(self, costs: pd.DataFrame, costs_store: pd.DataFrame, discount_rate: float = 0.07):
+        self.discount_rate = discount_rate
+        self.generators = pd.DataFrame({
+            'capital_cost': utils.annuity(costs.Lifetime, discount_rate)*costs.CAPEX*(1 + costs.FOM/costs.CAPEX),
+            'marginal_cost': costs.VOM + costs.Fuel/costs.Efficiency,
+            'efficiency': costs.Efficiency,
+            'co2_emissions': costs.CO2,
+        })
+        ratio = costs_store['Energy power ratio']
+        max_capacity = costs_store['Max capacity'].astype(float)
+        self.storage = pd.DataFrame({
+            'capital_cost': utils.annuity(costs_store.lifetime, discount_rate)*(
+                costs_store['CAPEX energy']*ratio + costs_store['CAPEX power']
+                + costs_store['OPEX fixed energy']*ratio + costs_store['OPEX fixed power']),
+            'marginal_cost': costs_store['Marginal cost']/costs_store.efficiency,
+            'efficiency': costs_store.efficiency,
+            'max_hours': ratio,
+            'p_nom_max': max_capacity.where(max_capacity <= self.unlimited_capacity, np.inf),
+            'co2_emissions': costs_store['CO2 emissions'],
+        })
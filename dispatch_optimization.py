@@ -1,91 +1,300 @@
 import pypsa
 import pandas as pd
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import utils
 import param
 import cartopy.crs as ccrs
 import cartopy.feature as cf
 import numpy as np
+import copy
+import os
+import tempfile
+import time
+import xarray as xr
+from solver import SolverConfig, iteration_counts
+from instrumentation import RunLog
+from rolling import RollingHorizon, NOMINAL_ATTRIBUTES
+
+
+def _figure(fig=None, path: str = None, **kwargs):
+    """Figure to draw on: fig cleared for reuse, a figure outside of pyplot when
+    it is only saved to path, or a new pyplot figure to show"""
+    if fig is not None:
+        fig.clf()
+        return fig
+    if path is not None:
+        return Figure(**kwargs)
+    return plt.figure(**kwargs)
+
+
+def _show(fig, path: str = None):
+    """Save the figure to path, or show it"""
+    if path is None:
+        plt.show()
+    else:
+        fig.savefig(path, bbox_inches='tight')
+
+
+class PersistentModel():
+    """
+    Optimization model built once and re-solved after updating the scenario
+    parameter in place. Each solve is warm started from the basis of the
+    previous one, which only helps simplex methods.
+    """
 
+    # Table and capacity variable of each component with extendable assets
+    capacity_variables = {'Generator': ('generators', 'p_nom'), 'StorageUnit': ('storage_units', 'p_nom'),
+                          'Link': ('links', 'p_nom'), 'Store': ('stores', 'e_nom'), 'Line': ('lines', 's_nom')}
+    aggregation = None  # TimeAggregation applied when solving
+    rolling = None  # RollingHorizon used to dispatch fixed capacities
+    objective = None  # Objective of the last solve (EUR)
+
+    def solve(self, solver: SolverConfig = None, cache=None, model_cache=None):
+        """
+        Build and solve the model. With a SolveCache, a network solved before
+        with the same inputs and solver settings is loaded instead. With a
+        ModelCache, a model built before for a network of the same structure is
+        loaded and patched with the current costs, constraints and profiles. With a
+        TimeAggregation, the aggregated network is solved and its results are
+        written back on the hourly network. With a RollingHorizon, the network
+        is dispatched window by window. The objective is stored in
+        self.objective, the solve status, wall time and iteration counts in
+        self.solve_stats, the time of each phase in self.run_log.
+        """
+        solver = solver or SolverConfig()
+        aggregation = self.aggregation
+        log = self.run_log
+        if aggregation is not None and self.rolling is not None:
+            raise ValueError('Rolling horizon dispatch needs the hourly network, not a time aggregation')
+        if cache is not None:
+            with log.phase('cache'):
+                settings = aggregation if self.rolling is None else self.rolling
+                key = cache.key(self.network, solver.backend, solver.solver_options(), settings)
+                solved = cache.get(key)
+            if solved is not None:
+                self.network, self.objective = solved
+                self.solve_stats = {'backend': solver.backend, 'status': 'cached', 'condition': 'cached', 'wall_time': 0.}
+                log.info.update(self.solve_stats)
+                self.solved()
+                return
+        if aggregation is not None:
+            with log.phase('aggregation'):
+                network = aggregation.apply(self.network)
+        else:
+            network = self.network
+        if self.rolling is not None:
+            with log.phase('solve'):
+                self.solve_stats = self.rolling.dispatch(network, solver)
+            self.objective = self.solve_stats.pop('objective')
+            log.info.update(self.solve_stats)
+        else:
+            with log.phase('model'):
+                if model_cache is not None:
+                    model_cache.create_model(network)
+                else:
+                    network.optimize.create_model()
+                if hasattr(aggregation, 'add_constraints'):
+                    aggregation.add_constraints(network)
+            self._solve_model(network, solver)
+            # Of the aggregated network with a TimeAggregation
+            self.objective = network.objective
+        with log.phase('results'):
+            if aggregation is not None:
+                aggregation.disaggregate(network, self.network)
+            if cache is not None:
+                cache.put(key, self.network, self.objective)
+            self.solved()
+
+    def _solve_model(self, network: pypsa.Network, solver: SolverConfig, **kwargs):
+        with self.run_log.phase('solve'):
+            start = time.perf_counter()
+            status, condition = network.optimize.solve_model(
+                solver_name=solver.backend, solver_options=solver.solver_options(), **kwargs)
+            self.solve_stats = {'backend': solver.backend, 'status': status, 'condition': condition,
+                                'wall_time': time.perf_counter() - start, **iteration_counts(network.model)}
+        self.run_log.info.update(self.solve_stats)
+        return status, condition
+
+    def build_model(self, snapshots=None, model_cache=None):
+        with self.run_log.phase('model'):
+            if model_cache is not None:
+                model_cache.create_model(self.network, snapshots)
+            else:
+                self.network.optimize.create_model(snapshots=snapshots)
+        self.model_directory = tempfile.TemporaryDirectory()
+        self.basis_file = os.path.join(self.model_directory.name, 'basis.bas')
+
+    def update_co2_limit(self, co2_limit: float):
+        """Update the constant of the CO2 constraint, in tCO2/year"""
+        self.network.global_constraints.loc['co2_limit', 'constant'] = co2_limit
+        self.network.model.constraints['GlobalConstraint-co2_limit'].rhs = co2_limit
+        self.co2_limit = co2_limit
 
-class BusElectricity():
-    def __init__(self, country: str, year: int, technologies, storage_technologies=None, network=pypsa.Network(), single_node: bool = True):
+    def update_capital_cost(self, component: str, capital_cost: pd.Series):
+        """Update the capital cost of extendable assets of a component, indexed by name"""
+        table, attribute = self.capacity_variables[component]
+        static = getattr(self.network, table)
+        delta = capital_cost - static.loc[capital_cost.index, 'capital_cost']
+        # The asset dimension of the variable is named by the pypsa version
+        variable = self.network.model[f'{component}-{attribute}'].loc[list(capital_cost.index)]
+        delta = xr.DataArray(delta.values, coords=variable.indexes, dims=variable.dims)
+        self.network.model.objective = self.network.model.objective.expression + (delta*variable).sum()
+        static.loc[capital_cost.index, 'capital_cost'] = capital_cost
+
+    def resolve(self, solver: SolverConfig = None):
+        """Solve the model built by build_model, with its current parameters"""
+        warmstart = {'warmstart_fn': self.basis_file} if os.path.exists(self.basis_file) else {}
+        status, condition = self._solve_model(self.network, solver or SolverConfig(),
+                                              basis_fn=self.basis_file, **warmstart)
+        self.objective = self.network.objective
+        with self.run_log.phase('results'):
+            self.solved()
+        return status, condition
+
+    def solved(self):
+        """Store the results of the last solve on the object"""
+
+    def summary(self) -> dict:
+        """
+        Key figures of the solved network, computed in one pass:
+        - 'generators': by bus and carrier, capacity (MW), energy (MWh),
+          capacity_factor, curtailment (available minus produced energy of the
+          generators with a profile, MWh) and co2 (tCO2)
+        - 'storage': by bus and carrier, capacity (MW), discharge and charge (MWh)
+        - 'price': load-weighted electricity price of each bus (EUR/MWh)
+        - 'co2': total emissions (tCO2)
+        Energies are weighted by the snapshot weightings.
+        """
+        network = self.network
+        weights = network.snapshot_weightings.generators.to_numpy()
+        generators = network.generators
+        p = network.generators_t.p.reindex(columns=generators.index, fill_value=0.).to_numpy()
+        p_max_pu = network.get_switchable_as_dense('Generator', 'p_max_pu').to_numpy()
+        energy = weights @ p
+        available = weights @ p_max_pu * generators.p_nom_opt.to_numpy()
+        has_profile = generators.index.isin(network.generators_t.p_max_pu.columns)
+        co2_emissions = generators.carrier.map(network.carriers.co2_emissions).fillna(0.).to_numpy()
+        table = pd.DataFrame({'capacity': generators.p_nom_opt.to_numpy(), 'energy': energy,
+                              'hours': generators.p_nom_opt.to_numpy()*weights.sum(),
+                              'curtailment': np.where(has_profile, available - energy, 0.),
+                              'co2': energy/generators.efficiency.to_numpy()*co2_emissions},
+                             index=generators.index)
+        table = table.groupby([generators.bus, generators.carrier]).sum()
+        table.insert(2, 'capacity_factor', (table.energy/table.pop('hours')).fillna(0.))
+
+        storage_units = network.storage_units
+        p = network.storage_units_t.p.reindex(columns=storage_units.index, fill_value=0.).to_numpy()
+        storage = pd.DataFrame({'capacity': storage_units.p_nom_opt.to_numpy(),
+                                'discharge': weights @ p.clip(min=0), 'charge': -(weights @ p.clip(max=0))},
+                               index=storage_units.index).groupby([storage_units.bus, storage_units.carrier]).sum()
+
+        loads = network.loads_t.p.reindex(columns=network.loads.index, fill_value=0.)
+        load = loads.T.groupby(network.loads.bus).sum().T
+        prices = network.buses_t.marginal_price.reindex(columns=load.columns)
+        price = pd.Series((weights @ (load*prices).to_numpy())/(weights @ load.to_numpy()), index=load.columns)
+        return {'generators': table, 'storage': storage, 'price': price, 'co2': table.co2.sum()}
+
+    def add_generators(self, names, buses, countries, technologies, data, p_nom_min=0., p_nom_max=np.inf):
+        """
+        Add extendable generators with one network.add call, with the costs of
+        param.cost_catalog. Every argument is a list with one entry per
+        generator (p_nom_min and p_nom_max may be scalars). data is the weather
+        data of each generator, passed to param.profile_data, or None for
+        dispatchable generators. The p_nom_max of hydro is at most the peak
+        inflow.
+        """
+        technologies = list(technologies)
+        n = len(technologies)
+        costs = param.cost_catalog.generators.loc[technologies]
+        carriers = list(dict.fromkeys(technologies))
+        self.network.add('Carrier', carriers, overwrite=True,
+                         co2_emissions=param.cost_catalog.generators.loc[carriers, 'co2_emissions'].values)
+        has_profile = np.array([d is not None for d in data], dtype=bool)
+        p_max_pu = pd.DataFrame({name: self._capacity_factor(technology, country, d)
+                                 for name, technology, country, d, profile in zip(names, technologies, countries, data, has_profile)
+                                 if profile}, index=self.network.snapshots)
+        p_nom_min = np.broadcast_to(np.asarray(p_nom_min, dtype=float), n)
+        p_nom_max = np.broadcast_to(np.asarray(p_nom_max, dtype=float), n).copy()
+        for i in np.flatnonzero(has_profile & (np.array(technologies) == 'Hydro')):
+            p_nom_max[i] = max(p_nom_min[i], 1000*param.hydro_inflow(data[i]).peak)
+        self.network.add('Generator', names, bus=buses, carrier=technologies, p_nom_extendable=True,
+                         capital_cost=costs.capital_cost.values, marginal_cost=costs.marginal_cost.values,
+                         efficiency=np.where(has_profile, 1., costs.efficiency.values),
+                         p_nom_min=p_nom_min, p_nom_max=p_nom_max)
+        # Only the generators with a profile get a p_max_pu column
+        existing = self.network.generators_t.p_max_pu
+        self.network.generators_t['p_max_pu'] = pd.concat(
+            [existing.drop(columns=p_max_pu.columns, errors='ignore'), p_max_pu], axis=1).rename_axis(columns='Generator')
+
+    def add_storage_units(self, names, buses, technologies):
+        """Add extendable storage units with one network.add call, with the
+        costs of param.cost_catalog. Every argument is a list with one entry per unit."""
+        technologies = list(technologies)
+        costs = param.cost_catalog.storage.loc[technologies]
+        carriers = list(dict.fromkeys(technologies))
+        self.network.add('Carrier', carriers, overwrite=True,
+                         co2_emissions=param.cost_catalog.storage.loc[carriers, 'co2_emissions'].values)
+        self.network.add('StorageUnit', names, bus=buses, carrier=technologies, p_nom_extendable=True,
+                         p_nom_max=costs.p_nom_max.values, capital_cost=costs.capital_cost.values,
+                         marginal_cost=costs.marginal_cost.values, cyclic_state_of_charge=True,
+                         max_hours=costs.max_hours.values, efficiency_store=costs.efficiency.values,
+                         efficiency_dispatch=costs.efficiency.values)
+
+    def _capacity_factor(self, technology_name: str, country: str, data_prod) -> np.ndarray:
+        if self.profiles is not None and not isinstance(data_prod, pd.DataFrame):
+            return self.profiles.profile(technology_name, country, self.year)
+        return param.capacity_factor(technology_name, country, self.year, data_prod)
+
+
+class BusElectricity(PersistentModel):
+    def __init__(self, country: str, year: int, technologies, storage_technologies=None, network=None, single_node: bool = True, profiles=None, aggregation=None, run_log=None):
         self.country = country
         self.year = year
         self.name = f'{country} electriciy'
-        self.network = network
+        self.network = network if network is not None else pypsa.Network()
         self.single_node = single_node
-        hours_in_year = pd.date_range(f'{self.year}-01-01 00:00Z',
-                                      f'{self.year}-12-31 23:00Z',
-                                      freq='h')
-        hours_in_year = hours_in_year[~(
-            (hours_in_year.month == 2) & (hours_in_year.day == 29))]
-        self.network.set_snapshots(hours_in_year.values)
+        self.profiles = profiles
+        self.aggregation = aggregation  # TimeAggregation applied when solving
+        self.run_log = run_log if run_log is not None else RunLog(self.name)
+        self.network.set_snapshots(utils.hours_in_year(self.year).values)
         self.network.add(
             'Bus', self.name, y=param.country_coords[country][0], x=param.country_coords[country][1],)
-        # Load electricity demand data
-        df_elec = pd.read_csv('data/electricity_demand.csv',
-                              sep=';', index_col=0)  # in MWh
-        df_elec.index = pd.to_datetime(
-            df_elec.index)  # change index to datetime
-        # Add load to the bus
-        self.network.add("Load",
-                         f"{self.country} load",
-                         bus=self.name,
-                         p_set=df_elec[self.country].values)
+        # Add load to the bus, electricity demand in MWh
+        with self.run_log.phase('demand'):
+            self.network.add("Load",
+                             f"{self.country} load",
+                             bus=self.name,
+                             p_set=param.electricity_demand(self.country, self.year))
 
         self.objective_value = 0
         self.electricity_price = 0
         self.technologies = technologies
-        self.populate_generators()
+        with self.run_log.phase('generators'):
+            self.populate_generators()
         if storage_technologies:
             self.storage_technologies = storage_technologies
-            self.populate_storage()
+            with self.run_log.phase('storage'):
+                self.populate_storage()
+
+    def _names(self, technologies) -> list:
+        return list(technologies) if self.single_node else [f"{self.country} {technology}" for technology in technologies]
 
     def populate_generators(self):
-        for key, df in self.technologies.items():
-            self.add_generator(key, param.costs.loc[key, 'CAPEX'], param.costs.loc[key, 'FOM'],
-                               param.costs.loc[key, 'VOM'], param.costs.loc[key,'Fuel'], param.costs.loc[key, 'Lifetime'],
-                               param.costs.loc[key, 'Efficiency'], param.costs.loc[key, 'CO2'], df)
+        technologies = list(self.technologies)
+        self.add_generators(self._names(technologies), [self.name]*len(technologies), [self.country]*len(technologies),
+                            technologies, list(self.technologies.values()))
+
     def populate_storage(self):
-        for key, df in self.storage_technologies.items():
-            self.add_storage(key, param.costs_store.loc[key, 'Max capacity'], 
-                            param.costs_store.loc[key, 'CAPEX power'], param.costs_store.loc[key, 'CAPEX energy'], 
-                            param.costs_store.loc[key, 'OPEX fixed power'], param.costs_store.loc[key, 'OPEX fixed energy'], 
-                            param.costs_store.loc[key, 'Marginal cost'], param.costs_store.loc[key, 'lifetime'], 
-                            param.costs_store.loc[key, 'efficiency'], param.costs_store.loc[key, 'CO2 emissions'],
-                            param.costs_store.loc[key, 'Energy power ratio'])
-        
+        technologies = list(self.storage_technologies)
+        self.add_storage_units(self._names(technologies), [self.name]*len(technologies), technologies)
 
-    def add_generator(self, technology_name: str, capex: float, opex_fixed: float, opex_variable: float, fuel_cost: float, lifetime: int, efficiency: float, CO2_emissions: float, data_prod=None):
+    def capacity_factor(self, technology_name: str, data_prod) -> np.ndarray:
         """
-        Add a generator in our network object.
+        Hourly capacity factor of a technology at this bus. It is read from the
+        profile cube if one was given, unless data_prod is a custom DataFrame.
         """
-        annualized_cost = utils.annuity(
-            lifetime, 0.07)*capex*(1+opex_fixed/capex)
-        marginal_cost = opex_variable + fuel_cost/efficiency
-        carrier_name = technology_name
-        self.network.add('Carrier', carrier_name,
-                         co2_emissions=CO2_emissions, overwrite=True)
-        generator_name = technology_name if self.single_node else f"{self.country} {technology_name}"
-
-        if data_prod is not None:
-            if technology_name == 'Hydro':
-                P_max_pu = data_prod['Inflow pu'][[hour.strftime(
-                    '2010-%m-%d %H:%M:%S') for hour in self.network.snapshots]]
-                self.network.add('Generator', carrier=carrier_name, name=generator_name,
-                                 bus=self.name, p_nom_extendable=True, capital_cost=annualized_cost,
-                                 marginal_cost=marginal_cost, p_max_pu=P_max_pu.values, p_nom_max=1000*data_prod['Inflow [GW]'].max())
-            else:
-                CF = data_prod[self.country][[hour.strftime(
-                    '%Y-%m-%dT%H:%M:%SZ') for hour in self.network.snapshots]]
-                self.network.add('Generator', carrier=carrier_name, name=generator_name,
-                                 bus=self.name, p_nom_extendable=True, capital_cost=annualized_cost,
-                                 marginal_cost=marginal_cost, p_max_pu=CF.values)
-        else:
-            self.network.add('Generator', carrier=carrier_name, name=generator_name,
-                             bus=self.name, p_nom_extendable=True, capital_cost=annualized_cost,
-                             marginal_cost=marginal_cost, efficiency=efficiency)
+        return self._capacity_factor(technology_name, self.country, data_prod)
 
     def add_bus(self) -> pypsa.Network:
         return self.network
@@ -125,7 +334,7 @@ class BusElectricity():
                                  p_nom_extendable = True, efficiency = 0.45,
                                  capital_cost = CCGTH2_capex)
     
-    def plot_electrolysis(self, start_date, end_date):
+    def plot_electrolysis(self, start_date, end_date, path: str = None, fig=None):
         origin = pd.Timestamp(f"{self.year}-01-01 00:00")
         start_index = int((start_date-origin).total_seconds()/3600)
         end_index = int((end_date-origin).total_seconds()/3600)
@@ -134,7 +343,8 @@ class BusElectricity():
         net_hydrogen = -self.network.links_t.p1['Electrolyser'][start_index:end_index] - param.hourly_hydrogen_demand[start_index:end_index]
 
         # Create the figure and axes
-        fig, ax1 = plt.subplots(figsize=(10, 6))
+        fig = _figure(fig, path, figsize=(10, 6))
+        ax1 = fig.add_subplot()
         ax2 = ax1.twinx()
 
         # Plot electrolysis production and hydrogen demand difference
@@ -155,104 +365,87 @@ class BusElectricity():
 
         # Add grid and improve layout
         ax1.grid(linewidth=0.4, linestyle='--', alpha=0.7)
-        #plt.title('Hydrogen Electrolysis and Storage Dynamics', fontsize=14, fontweight='bold')
-        plt.tight_layout()
+        #ax1.set_title('Hydrogen Electrolysis and Storage Dynamics', fontsize=14, fontweight='bold')
+        fig.tight_layout()
 
         # Show the plot
-        plt.show()
-        start_index = int((start_date-origin).total_seconds()/3600)
-        end_index = int((end_date-origin).total_seconds()/3600)
-        
-    
-    def plot_electrolysis_storage(self, start_date, end_date):
-        plt.plot(self.network.stores_t.e['Hydrogen Storage'].loc[start_date:end_date], label='Hydrogen storage', color = 'blue')
-        plt.legend(fancybox = 'True', loc = 'best')
-        plt.xlabel('Time')
-        plt.ylabel('Hydrogen storage')
-        plt.grid(linewidth='0.4', linestyle='--')
-        plt.show()
-
-
-
-    def add_storage(self, technology_name: str, max_cap: float, capex_pow: float, capex_en: float, opex_fixed_pow: float, opex_fixed_en: float, marginal_cost: float, lifetime: int, efficiency: float, CO2_emissions: float, energy_power_ratio: int):
-        carrier_name = technology_name
-        self.network.add('Carrier', carrier_name, co2_emissions=CO2_emissions)
-        annualized_cost = utils.annuity(lifetime, 0.07)*(
-            capex_en*energy_power_ratio + capex_pow + opex_fixed_en*energy_power_ratio + opex_fixed_pow)
-
-        storage_name = technology_name if self.single_node else f"{self.country} {technology_name}"
-
-        if max_cap > 500000:
-            self.network.add('StorageUnit', storage_name,
-                             carrier=technology_name, bus=self.name, p_nom_extendable=True,
-                             capital_cost=annualized_cost, marginal_cost=marginal_cost/efficiency,
-                             cyclic_state_of_charge=True, max_hours=energy_power_ratio,
-                             efficiency_store=efficiency, efficiency_dispatch=efficiency)
-
-        else:
-            self.network.add('StorageUnit', storage_name,
-                             carrier=technology_name, bus=self.name, p_nom_extendable=True, p_nom_max=max_cap,
-                             capital_cost=annualized_cost, marginal_cost=marginal_cost/efficiency,
-                             cyclic_state_of_charge=True, max_hours=energy_power_ratio,
-                             efficiency_store=efficiency, efficiency_dispatch=efficiency)
-
-    def optimize(self):
-        self.network.optimize(solver_name='gurobi')
-        self.objective_value = self.network.objective / \
+        _show(fig, path)
+        return fig
+
+    def plot_electrolysis_storage(self, start_date, end_date, path: str = None, fig=None):
+        fig = _figure(fig, path)
+        ax = fig.add_subplot()
+        ax.plot(self.network.stores_t.e['Hydrogen Storage'].loc[start_date:end_date], label='Hydrogen storage', color = 'blue')
+        ax.legend(fancybox = 'True', loc = 'best')
+        ax.set_xlabel('Time')
+        ax.set_ylabel('Hydrogen storage')
+        ax.grid(linewidth='0.4', linestyle='--')
+        _show(fig, path)
+        return fig
+
+    def optimize(self, solver: SolverConfig = None, cache=None, model_cache=None):
+        self.solve(solver, cache, model_cache)
+
+    def solved(self):
+        self.objective_value = self.objective / \
             1000000  # in 10^6 € (or M€)
-        self.electricity_price = (self.network.objective/self.network.loads_t.p.sum())[0]
+        self.electricity_price = (self.objective/self.network.loads_t.p.sum()).iloc[0]
 
-    def plot_line(self, start_date, end_date):
+    def plot_line(self, start_date, end_date, path: str = None, fig=None):
         origin = pd.Timestamp(f"{self.year}-01-01 00:00")
         start_index = int((start_date-origin).total_seconds()/3600)
         end_index = int((end_date-origin).total_seconds()/3600)
-        plt.plot(
+        fig = _figure(fig, path)
+        ax = fig.add_subplot()
+        ax.plot(
             self.network.loads_t.p[f'{self.country} load'][start_index:end_index], color='black', label='Demand')
-        producers = [
-            generator for generator in self.network.generators.loc[self.network.generators.p_nom_opt != 0].index]
-        for i, generator in enumerate(producers):
-            plt.plot(self.network.generators_t.p[str(generator)][start_index:end_index], label=str(
-                generator), color=param.colors[str(generator)])
-        plt.legend(fancybox=True, loc='best')
-        plt.xlabel('Time')
-        plt.ylabel('Electricity production (MWh)')
-        plt.grid(linewidth='0.4', linestyle='--')
-        # plt.title('Electricity production dispatch')
-        plt.show()
-
-    def plot_storage(self, start_date, end_date):
+        producers = self.network.generators.index[self.network.generators.p_nom_opt != 0]
+        production = self.network.generators_t.p.iloc[start_index:end_index]
+        for generator in producers:
+            ax.plot(production[generator], label=generator, color=param.colors[generator])
+        ax.legend(fancybox=True, loc='best')
+        ax.set_xlabel('Time')
+        ax.set_ylabel('Electricity production (MWh)')
+        ax.grid(linewidth='0.4', linestyle='--')
+        # ax.set_title('Electricity production dispatch')
+        _show(fig, path)
+        return fig
+
+    def plot_storage(self, start_date, end_date, path: str = None, fig=None):
         origin = pd.Timestamp(f"{self.year}-01-01 00:00")
         start_index = int((start_date-origin).total_seconds()/3600)
         end_index = int((end_date-origin).total_seconds()/3600)
-        plt.figure()
+        fig = _figure(fig, path)
+        ax = fig.add_subplot()
         for i, storage_unit in enumerate(self.network.storage_units_t.p.columns):
-            plt.plot(self.network.storage_units_t.p[str(
+            ax.plot(self.network.storage_units_t.p[str(
                 storage_unit)][start_index:end_index], color=param.colors[str(storage_unit)], label=str(storage_unit))
-        plt.legend(fancybox=True, loc='best')
-        plt.show()
-
-    def plot_pie(self, production: bool = True):
-        labels = [
-            generator for generator in self.network.generators.loc[self.network.generators.p_nom_opt != 0].index]
-        if production:
-            sizes = [self.network.generators_t.p[generator].sum()
-                     for generator in labels]
-        else:
-            sizes = [self.network.generators.p_nom_opt[generator]
-                     for generator in labels]
-        colors = [param.colors[generator] for generator in labels]
-        plt.pie(sizes,
-                colors=colors,
-                labels=labels,
-                autopct=lambda pct: f"{pct:.1f}%",
-                wedgeprops={'linewidth': 0})
-        plt.axis('equal')
-
-        # plt.title('Electricity mix', y=1.07)
-        plt.show()
-
-    def plot_duration_curve(self):
-        fig, (ax1, ax2) = plt.subplots(1, 2)
+        ax.legend(fancybox=True, loc='best')
+        _show(fig, path)
+        return fig
+
+    def plot_pie(self, production: bool = True, path: str = None, fig=None):
+        mix = self.summary()['generators'].groupby('carrier', sort=False).sum()
+        mix = mix[mix.capacity != 0]
+        sizes = mix.energy if production else mix.capacity
+        labels = list(mix.index)
+        colors = [param.colors[carrier] for carrier in labels]
+        fig = _figure(fig, path)
+        ax = fig.add_subplot()
+        ax.pie(sizes,
+               colors=colors,
+               labels=labels,
+               autopct=lambda pct: f"{pct:.1f}%",
+               wedgeprops={'linewidth': 0})
+        ax.axis('equal')
+
+        # ax.set_title('Electricity mix', y=1.07)
+        _show(fig, path)
+        return fig
+
+    def plot_duration_curve(self, path: str = None, fig=None):
+        fig = _figure(fig, path)
+        ax1, ax2 = fig.subplots(1, 2)
         producers = [
             generator for generator in self.network.generators.loc[self.network.generators.p_nom_opt != 0].index]
         for i, generator in enumerate(producers):
@@ -269,19 +462,19 @@ class BusElectricity():
         ax2.legend(fancybox=True, loc='best')
         ax2.set(xlabel='Hours', ylabel='Capacity factor')
         ax2.grid(linewidth='0.4', linestyle='--')
-        plt.show()
+        _show(fig, path)
+        return fig
 
-    def plot_dispatch(self, time):
+    def plot_dispatch(self, time, path: str = None, fig=None):
         p_by_gen = self.network.generators_t.p.div(1e3)
-        print(p_by_gen)
         if not self.network.storage_units.empty:
             sto = self.network.storage_units_t.p.div(1e3)
             p_by_gen = pd.concat([p_by_gen, sto], axis=1)
 
-        fig, ax = plt.subplots(figsize=(6, 3))
+        fig = _figure(fig, path, figsize=(6, 3))
+        ax = fig.add_subplot()
 
         gen = p_by_gen.where(p_by_gen >= 0).loc[f'{time}']
-        print(gen)
         labels_p = [str(generator) for generator in gen.columns]
         colors_p = [param.colors[generator] for generator in gen.columns]
         ax.stackplot(gen.index, gen.T, colors=colors_p, labels=labels_p)
@@ -298,11 +491,12 @@ class BusElectricity():
         ax.plot(load, label='Load', color='black')
         # self.network.loads_t.p_set.sum(axis=1).loc[time].div(1e3).plot(ax=ax, c="k", linewidth = 1)
 
-        plt.legend()
+        ax.legend()
         ax.set_ylabel("GW")
         # ax.set_ylim(-200, 200)
-        plt.title(f'Optimal dispatch {time}')
-        plt.show()
+        ax.set_title(f'Optimal dispatch {time}')
+        _show(fig, path)
+        return fig
 
     def return_production_mix(self) -> pd.DataFrame:
         return self.network.generators_t.p.sum()
@@ -313,52 +507,81 @@ class BusElectricity():
 
 class ExistingBusElectricity(BusElectricity):
     def populate_generators(self):
-        for key, dict in self.technologies.items():
-            self.add_generator(key, param.costs.loc[key, 'CAPEX'], param.costs.loc[key, 'FOM'],
-                            param.costs.loc[key, 'VOM'], param.costs.loc[key, 'Fuel'], param.costs.loc[key, 'Lifetime'],
-                            param.costs.loc[key, 'Efficiency'], param.costs.loc[key, 'CO2'], p_min=dict['p_min'], p_max=dict['p_max'], data_prod=dict['df'])
+        technologies = list(self.technologies)
+        specs = list(self.technologies.values())
+        self.add_generators(self._names(technologies), [self.name]*len(technologies), [self.country]*len(technologies),
+                            technologies, [spec['df'] for spec in specs],
+                            p_nom_min=[spec['p_min'] for spec in specs], p_nom_max=[spec['p_max'] for spec in specs])
 
-    def add_generator(self, technology_name, capex, opex_fixed, opex_variable, fuel_cost, lifetime, efficiency, CO2_emissions, p_min, p_max, data_prod=None):
+    def rolling_dispatch(self, capacities=None, window: int = 168, overlap: int = 24):
         """
-        Add a generator in our network object.
+        Switch to operational dispatch: the capacities of all the assets
+        (p_nom, e_nom, s_nom) are fixed and optimize solves windows of window
+        hours with overlap hours of look-ahead (see RollingHorizon).
+        capacities maps a technology to the capacity in MW of its generators
+        and storage units, as param.installed_capa; the other assets keep the
+        optimal capacity of the last solve or, if the network was not solved,
+        their nominal capacity (the minimum one for extendable assets).
         """
-        annualized_cost = utils.annuity(
-            lifetime, 0.07)*capex*(1+opex_fixed/capex)
-        marginal_cost = opex_variable + fuel_cost/efficiency
-        carrier_name = technology_name
-        self.network.add('Carrier', carrier_name,
-                         co2_emissions=CO2_emissions, overwrite=True)
-        generator_name = technology_name if self.single_node else f"{self.country} {technology_name}"
-        print(data_prod)
-        if data_prod is not None:
-            if technology_name == 'Hydro':
-                P_max_pu = data_prod['Inflow pu'][[hour.strftime(
-                    '2010-%m-%d %H:%M:%S') for hour in self.network.snapshots]]
-                p_max = max(p_min, 1000*data_prod['Inflow [GW]'].max())
-                self.network.add('Generator', carrier=carrier_name, name=generator_name,
-                                 bus=self.name, p_nom_extendable=True, capital_cost=annualized_cost,
-                                 marginal_cost=marginal_cost, p_max_pu=P_max_pu.values, p_nom_max=p_max, p_nom_min=p_min)
+        for component, attribute in NOMINAL_ATTRIBUTES:
+            static = getattr(self.network, component)
+            if static.empty:
+                continue
+            if (static[f'{attribute}_opt'] > 0).any():
+                fixed = static[f'{attribute}_opt']
             else:
-                CF = data_prod[self.country][[hour.strftime(
-                    '%Y-%m-%dT%H:%M:%SZ') for hour in self.network.snapshots]]
-                self.network.add('Generator', carrier=carrier_name, name=generator_name,
-                                 bus=self.name, p_nom_extendable=True, capital_cost=annualized_cost,
-                                 marginal_cost=marginal_cost, p_max_pu=CF.values, p_nom_min = p_min, p_nom_max=p_max)
-        else:
-            self.network.add('Generator', carrier=carrier_name, name=generator_name,
-                             bus=self.name, p_nom_extendable=True, capital_cost=annualized_cost,
-                             marginal_cost=marginal_cost, efficiency=efficiency, p_nom_min = p_min, p_nom_max=p_max)
+                fixed = static[attribute].where(~static[f'{attribute}_extendable'], static[f'{attribute}_min'])
+            if capacities is not None and component in ('generators', 'storage_units'):
+                fixed = static.carrier.map(capacities).fillna(fixed)
+            static[attribute] = fixed.astype(float)
+            static[f'{attribute}_extendable'] = False
+        self.rolling = RollingHorizon(window, overlap)
+
 
-class NetworkElectricity():
-    def __init__(self, year: int):
+class NetworkElectricity(PersistentModel):
+    def __init__(self, year: int, profiles=None, aggregation=None, run_log=None):
         self.network = pypsa.Network()
         self.year = year
+        self.profiles = profiles
+        self.aggregation = aggregation  # TimeAggregation applied when solving
+        self.run_log = run_log if run_log is not None else RunLog(f'network {year}')
 
     def add_country(self, country_name, technologies):
-        self.network = BusElectricity(
-            country=country_name, year=self.year, technologies=technologies, single_node=False).add_bus()
+        with self.run_log.phase('add_country'):
+            self.network = BusElectricity(
+                country=country_name, year=self.year, technologies=technologies, network=self.network,
+                single_node=False, profiles=self.profiles, aggregation=self.aggregation,
+                run_log=self.run_log).add_bus()
 
-    def add_line(self, country0: str, country1: str, capacity: float, reactance: float, resistance: float, capital_cost: float, extendable: bool):
+    def add_countries(self, technologies_by_country: dict):
+        """
+        Add the buses, loads, carriers and generators of several countries,
+        with one network.add call per component. technologies_by_country maps
+        each country to its technologies, as param.technologies_by_country.
+        The network is the same as with add_country for each country.
+        """
+        countries = list(technologies_by_country)
+        with self.run_log.phase('add_countries'):
+            snapshots = utils.hours_in_year(self.year).values
+            if not self.network.snapshots.equals(pd.Index(snapshots)):
+                self.network.set_snapshots(snapshots)
+            buses = [f'{country} electriciy' for country in countries]
+            self.network.add('Bus', buses, y=[param.country_coords[country][0] for country in countries],
+                             x=[param.country_coords[country][1] for country in countries])
+            with self.run_log.phase('demand'):
+                loads = [f'{country} load' for country in countries]
+                demand = np.column_stack([param.electricity_demand(country, self.year) for country in countries])
+                self.network.add('Load', loads, bus=buses,
+                                 p_set=pd.DataFrame(demand, index=self.network.snapshots, columns=loads))
+
+            with self.run_log.phase('generators'):
+                generators = [(f'{country} {technology}', f'{country} electriciy', country, technology, data)
+                              for country, technologies in technologies_by_country.items()
+                              for technology, data in technologies.items()]
+                self.add_generators(*map(list, zip(*generators)))
+
+    def add_line(self, country0: str, country1: str, capacity: float, reactance: float, resistance: float, capital_cost: float, extendable: bool, length: float = 0):
+        """Add a line between two countries, length in km"""
         self.network.add('Line', f"{country0}-{country1}",
                          bus0=f'{country0} electriciy',
                          bus1=f'{country1} electriciy',
@@ -367,8 +590,41 @@ class NetworkElectricity():
                          r=resistance,
                          capital_cost=capital_cost,
                          s_nom_extendable=extendable,
+                         length=length,
                          overwrite=True)
 
+    def add_lines(self, countries0, countries1, lengths, capacity: float = 0., reactance: float = 1e-3,
+                  resistance: float = 1e-3, line_cost: float = 0., extendable: bool = True):
+        """
+        Add the lines between countries0[i] and countries1[i] with one
+        network.add call. lengths in km; reactance and resistance in ohm/km,
+        line_cost in EUR/MW/km, both scaled by the length of each line.
+        """
+        lengths = np.asarray(lengths, dtype=float)
+        self.network.add('Line', [f'{country0}-{country1}' for country0, country1 in zip(countries0, countries1)],
+                         bus0=[f'{country} electriciy' for country in countries0],
+                         bus1=[f'{country} electriciy' for country in countries1],
+                         s_nom=capacity,
+                         x=reactance*lengths,
+                         r=resistance*lengths,
+                         capital_cost=line_cost*lengths,
+                         s_nom_extendable=extendable,
+                         length=lengths,
+                         overwrite=True)
+
+    def add_meshed_lines(self, k: int = 3, **kwargs):
+        """
+        Connect each country of the network to its k nearest countries
+        (great-circle distance between the coordinates of param.country_coords)
+        and add these lines with add_lines, which takes the other arguments.
+        """
+        countries = [bus.removesuffix(' electriciy') for bus in self.network.buses.index
+                     if bus.endswith(' electriciy')]
+        coords = np.array([param.country_coords[country] for country in countries])
+        pairs, lengths = utils.nearest_pairs(coords[:, 0], coords[:, 1], k)
+        countries = np.array(countries)
+        self.add_lines(countries[pairs[:, 0]], countries[pairs[:, 1]], lengths, **kwargs)
+
     def add_co2_constraints(self, co2_limit: float):
         """Add a CO2 constraint, with a co2_limit in tCO2/year"""
         self.co2_limit = co2_limit
@@ -379,8 +635,8 @@ class NetworkElectricity():
                          sense="<=",
                          constant=co2_limit)
 
-    def optimize(self):
-        self.network.optimize(solver_name='gurobi')
+    def optimize(self, solver: SolverConfig = None, cache=None, model_cache=None):
+        self.solve(solver, cache, model_cache)
         # self.objective_value = self.network.objective/1000000 # in 10^6 € (or M€)
         # self.electricity_price = self.network.objective/self.network.loads_t.p.sum()
 
@@ -388,9 +644,11 @@ class NetworkElectricity():
         print(self.network.generators_t.p.sum(axis=0).groupby(
             [self.network.generators.bus, self.network.generators.carrier]).sum().div(1e6).round(1))
 
-    def plot(self):
-        self.network.plot(bus_sizes=1, margin=1)
-        plt.show()
+    def plot(self, path: str = None, fig=None):
+        fig = _figure(fig, path)
+        self.network.plot(ax=fig.add_subplot(projection=ccrs.PlateCarree()), bus_sizes=1, margin=1)
+        _show(fig, path)
+        return fig
 
     def energy(self):
         print(self.network.lines_t.p0.abs().sum(axis=0))
@@ -407,18 +665,15 @@ class NetworkElectricity():
         print(self.network.lines.s_nom_opt)
 
     def return_production_mix(self):
+        """Hourly production of each carrier (MW)"""
         production = self.network.generators_t.p
-        carriers = self.network.generators.carrier
-        production_mix = pd.DataFrame(index=production.index)
-        for carrier in carriers.unique():
-            generators_of_carrier = carriers[carriers == carrier].index
-            production_mix[carrier] = production[generators_of_carrier].sum(axis=1)
-        return production_mix
-
-    def plot_map(self):
+        carriers = self.network.generators.carrier[production.columns]
+        return production.T.groupby(carriers, sort=False).sum().T
+
+    def plot_map(self, path: str = None, fig=None):
         # Setup map projection
-        fig, ax = plt.subplots(figsize=(10, 8), subplot_kw={
-                               'projection': ccrs.PlateCarree()})
+        fig = _figure(fig, path, figsize=(10, 8))
+        ax = fig.add_subplot(projection=ccrs.PlateCarree())
 
         # Add map features
         ax.add_feature(cf.BORDERS, linestyle=':')
@@ -432,21 +687,11 @@ class NetworkElectricity():
                  'Wind Offshore', 'Wind Onshore', 'Hydro', 'TACH2']
 
         # Prepare generation data
-        gen_mix = self.network.generators.copy()
-        gen_mix['country'] = gen_mix.bus.map(
-            lambda x: self.network.buses.loc[x, 'country'])
-        gen_mix["p_nom_opt"] = gen_mix["p_nom_opt"]/1e3
-        generation_sum = self.network.generators_t.p.sum().div(1e6)
-        grouped = gen_mix.groupby(['country', 'carrier'])
-
-        gen = {
-            country: {
-                tech: generation_sum[gen_mix[(gen_mix.country == country) & (
-                    gen_mix.carrier == tech)].index].sum()
-                for tech in techs
-            }
-            for country in self.network.buses.country.unique()
-        }
+        generation = self.summary()['generators'].energy.div(1e6)
+        countries = generation.index.get_level_values('bus').map(self.network.buses.country)
+        gen = generation.groupby([countries, generation.index.get_level_values('carrier')]).sum().unstack(
+            fill_value=0.).reindex(index=self.network.buses.country.unique(), columns=techs, fill_value=0.)
+        gen = gen.to_dict('index')
 
         # Calculate transmitted energy for each line
         transmitted_energy = self.network.lines_t.p0.abs().sum(axis=0)
@@ -469,8 +714,6 @@ class NetworkElectricity():
             energy = transmitted_energy[i]
             capacity = capacity_lines[i]
             width = capacity / 3e3  # scale appropriately
-            print("energy: ", energy, "   width: ",
-                  width, "    Capacity", capacity)
 
             if flow >= 0:
                 x_start, y_start = x0, y0
@@ -522,16 +765,74 @@ class NetworkElectricity():
         # Add legend
         legend_patches = [plt.Line2D(
             [0], [0], color=param.colors[tech], lw=4, label=tech) for tech in techs]
-        plt.legend(handles=legend_patches,
-                   title="Technologies", loc='upper left')
+        ax.legend(handles=legend_patches,
+                  title="Technologies", loc='upper left')
 
         # Add colorbar for energy transmitted
         sm = plt.cm.ScalarMappable(cmap=cmap, norm=energy_norm)
         sm.set_array([])
-        cbar = plt.colorbar(sm, ax=ax, orientation='vertical', pad=0.01)
+        cbar = fig.colorbar(sm, ax=ax, orientation='vertical', pad=0.01)
         cbar.set_label('Transmitted Energy')
 
-        plt.show()
+        _show(fig, path)
+        return fig
+
+
+
+class ScenarioTemplate():
+    """
+    Network built once for a sweep. Each scenario is derived from it by
+    overriding a few parameters, on a copy of the network or in place.
+    """
+
+    def __init__(self, base):
+        self.base = base  # BusElectricity or NetworkElectricity
+        # Reference costs, so that multipliers applied in place do not compound
+        self.generator_costs = base.network.generators.capital_cost.copy()
+        self.storage_costs = base.network.storage_units.capital_cost.copy()
+
+    def scenario(self, in_place: bool = False, co2_limit: float = None, line_cost: float = None,
+                 capex_multipliers: dict = None, storage_max: dict = None):
+        """
+        Return the base object with the given overrides:
+        - co2_limit: constant of the CO2 constraint in tCO2/year
+        - line_cost: capital cost of the lines in EUR/MW/km, scaled by their length
+        - capex_multipliers: {carrier: factor} applied to the reference capital costs
+        - storage_max: {carrier: p_nom_max} of the storage units in MW
+        """
+        if in_place:
+            scenario = self.base
+        else:
+            scenario = copy.copy(self.base)
+            scenario.network = self.base.network.copy()
+            # Settings that keep state between runs are copied, and the model
+            # built on the base (with its basis file) stays with the base
+            scenario.aggregation = copy.deepcopy(self.base.aggregation)
+            scenario.rolling = copy.deepcopy(self.base.rolling)
+            for attribute in ('model_directory', 'basis_file'):
+                vars(scenario).pop(attribute, None)
+        # Each scenario logs its own phases, not those of the base and earlier scenarios
+        log = self.base.run_log
+        scenario.run_log = RunLog(log.name, log.profiler, log.profile_directory)
+        network = scenario.network
+
+        if co2_limit is not None:
+            if 'co2_limit' in network.global_constraints.index:
+                network.global_constraints.loc['co2_limit', 'constant'] = co2_limit
+                scenario.co2_limit = co2_limit
+            else:
+                scenario.add_co2_constraints(co2_limit)
+        if line_cost is not None:
+            network.lines.capital_cost = line_cost*network.lines.length
+        multipliers = capex_multipliers or {}
+        if in_place or multipliers:
+            network.generators.capital_cost = self.generator_costs * \
+                network.generators.carrier.map(multipliers).fillna(1)
+            network.storage_units.capital_cost = self.storage_costs * \
+                network.storage_units.carrier.map(multipliers).fillna(1)
+        for carrier, p_nom_max in (storage_max or {}).items():
+            network.storage_units.loc[network.storage_units.carrier == carrier, 'p_nom_max'] = p_nom_max
+        return scenario
 
 
 # france_net = BusElectricity('FRA', param.year, technologies=param.technologies_france)
@@ -16,9 +16,7 @@ plt.plot(param.df_onshorewind.loc[hours_in_year, country].sort_values(ascending=
 plt.plot(param.df_solar.loc[hours_in_year, country].sort_values(ascending=False,ignore_index=True),
                      color=param.colors["PV"],
                      label="PV")
-plt.plot(param.df_hydro.loc[pd.date_range(f'2010-01-01 00:00',
-                              f'2010-12-31 23:00',
-                              freq='h'), 'Inflow pu'].sort_values(ascending=False,ignore_index=True),
+plt.plot(pd.Series(param.hydro_inflow().capacity_factor(param.hydro_reference_year)).sort_values(ascending=False,ignore_index=True),
                      color=param.colors["Hydro"],
                      label="Hydro")
 
@@ -0,0 +1,68 @@
+import dataclasses
+import os
+import matplotlib
+from solver import SolverConfig
+from sweep import init_worker, scenario_name, worker_build, worker_count, worker_pool
+
+# Figures of scenario batches rendered without a display. Each worker process
+# uses the Agg backend, builds and solves its scenarios, and draws each kind
+# of figure on one Figure object that is cleared and reused from a scenario to
+# the next, so no window is opened and figures do not pile up in memory. When
+# the calling process renders alone, it keeps its own backend.
+
+_figures = {}
+
+
+def headless():
+    """Render figures to files only (Agg backend), without opening windows"""
+    matplotlib.use('Agg')
+
+
+def _init_renderer():
+    headless()
+    _figures.clear()
+
+
+def _render(scenario: dict, figures: dict, directory: str, solver: SolverConfig, cache, format: str) -> list[str]:
+    model = worker_build()(**scenario)
+    model.optimize(solver=solver, cache=cache)
+    paths = []
+    for name, (method, kwargs) in figures.items():
+        path = os.path.join(directory, f'{name}_{scenario_name(scenario)}.{format}')
+        # Plot methods return their figure, which is drawn on again for the
+        # next scenario
+        _figures[name] = getattr(model, method)(**kwargs, path=path, fig=_figures.get(name))
+        paths.append(path)
+    return paths
+
+
+def export_figures(build, scenarios: list[dict], figures: dict, directory: str = 'results/figures',
+                   workers: int = None, solver: SolverConfig = None, cache=None, format: str = 'png') -> list[str]:
+    """
+    Solve every scenario and save its figures to directory, named
+    '<figure>_<scenario>.<format>'. figures maps a figure name to the plot
+    method of the model and its arguments, e.g.
+    {'mix': ('plot_pie', {}), 'winter': ('plot_dispatch', {'time': '2019-01'})}.
+    build(**scenario) returns a BusElectricity or NetworkElectricity, as for
+    sweep.run_sweep. Scenarios are rendered in workers processes with one
+    solver thread each; solved networks are reused from cache when given.
+    Returns the paths of the figures.
+    """
+    os.makedirs(directory, exist_ok=True)
+    workers = worker_count(workers, 1, len(scenarios))
+    solver = dataclasses.replace(solver or SolverConfig(), threads=1)
+    arguments = (figures, directory, solver, cache, format)
+
+    if workers == 1:
+        # Saved figures are Figure objects outside of pyplot, which render
+        # without a display, so the calling process keeps its backend for
+        # the figures it shows later
+        init_worker(build, _figures.clear)
+        try:
+            paths = [_render(scenario, *arguments) for scenario in scenarios]
+        finally:
+            _figures.clear()
+    else:
+        with worker_pool(build, workers, _init_renderer) as executor:
+            paths = list(executor.map(_render, scenarios, *([argument]*len(scenarios) for argument in arguments)))
+    return [path for scenario_paths in paths for path in scenario_paths]
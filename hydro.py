@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import utils
+
+
+class HydroInflow():
+    """
+    Daily hydro inflow, kept at daily resolution: hourly values are read
+    through an hour -> day index built once per simulated year. With
+    year_matched, each year uses its own inflow when the record covers it,
+    and the inflow of reference_year otherwise; else every year uses the
+    inflow of reference_year. Hours are those of utils.hours_in_year, so the
+    29th of February is never used and other days are matched by month and day.
+    """
+
+    def __init__(self, daily: pd.Series, reference_year: int = 2010, year_matched: bool = False):
+        # Daily energy in GWh, indexed by date
+        self.daily = daily.to_numpy(dtype=float)
+        self.dates = pd.DatetimeIndex(daily.index).normalize().tz_localize(None)
+        self.reference_year = reference_year
+        self.year_matched = year_matched
+        self.peak = self.daily.max()/24  # GW
+        self._index = {}
+
+    def source_year(self, year: int) -> int:
+        """Year of the record used for year"""
+        if self.year_matched and year in self.dates.year:
+            return year
+        return self.reference_year
+
+    def day_index(self, year: int) -> np.ndarray:
+        """Position in the daily record of the day used for each hour of year"""
+        if year not in self._index:
+            hours = utils.hours_in_year(year)
+            source = pd.to_datetime(pd.DataFrame({'year': self.source_year(year), 'month': hours.month, 'day': hours.day}))
+            index = self.dates.get_indexer(source)
+            if (index < 0).any():
+                raise KeyError(f'Missing hydro inflow in {self.source_year(year)}')
+            index.flags.writeable = False
+            self._index[year] = index
+        return self._index[year]
+
+    def inflow(self, year: int) -> np.ndarray:
+        """Hourly inflow of year in GW"""
+        return self.daily[self.day_index(year)]/24
+
+    def capacity_factor(self, year: int) -> np.ndarray:
+        """Hourly inflow of year relative to the peak of the record"""
+        return self.daily[self.day_index(year)]/(24*self.peak)
@@ -2,7 +2,7 @@ from dispatch_optimization import BusElectricity
 import param
 import pandas as pd
 import matplotlib.pyplot as plt
-import utils
+import spectral
 
 country = 'FRA'
 #france_net = BusElectricity(country, param.year, technologies=param.technologies_france)
@@ -56,9 +56,10 @@ print(france_net.network.buses_t.marginal_price.mean())
 # print(france_net.electricity_price)
 
 
-utils.fourier_transform([france_net.network.links_t.p0['Electrolyser'],
-                       france_net.network.stores_t.e['Hydrogen Storage']]
-                          ,colors=[param.colors['PHS_b'], param.colors['PHS_b']] )
-#utils.fourier_transform(france_net.network.storage_units_t.p['PHS_s'], color=param.colors['PHS_s'])
-#utils.fourier_transform(france_net.network.stores_t.e, color=param.colors['PHS_s'])
+spectrum = spectral.spectrum(pd.concat([france_net.network.links_t.p0['Electrolyser'],
+                                       france_net.network.stores_t.e['Hydrogen Storage']], axis=1))
+print(spectral.band_energy(spectrum))
+spectral.plot_spectrum(spectrum, colors={'Electrolyser': param.colors['PHS_b'], 'Hydrogen Storage': param.colors['PHS_b']})
+#spectral.plot_spectrum(spectral.spectrum(france_net.network.storage_units_t.p[['PHS_s']]), colors=param.colors)
+#spectral.plot_spectrum(spectral.spectrum(france_net.network.stores_t.e), colors=param.colors)
 #print([generator for generator in france_net.network.generators.loc[france_net.network.generators.p_nom_opt !=0].index])
@@ -0,0 +1,168 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def peak_rss() -> float:
+    """Peak resident memory of the process since it started, in MB"""
+    if resource is None:
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kB elsewhere
+    return peak/2**20 if sys.platform == 'darwin' else peak/2**10
+
+
+def current_rss() -> float:
+    """Resident memory of the process now, in MB"""
+    try:
+        with open('/proc/self/statm') as f:  # Linux
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/2**20
+    except OSError:
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss/2**20
+    return float('nan')
+
+
+class _RssSampler(threading.Thread):
+    """Thread sampling the resident memory every interval seconds and keeping
+    the highest value of each open phase in peaks"""
+
+    def __init__(self, interval: float = 0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peaks = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        rss = current_rss()
+        with self.lock:
+            for peak in self.peaks:
+                peak[0] = max(peak[0], rss)
+
+
+class RunLog():
+    """
+    Wall time and peak memory of the phases of a model run (data loading,
+    network build, model build, solve, results), timed with
+    `with log.phase('name'):`. The peak_rss of a phase is the highest
+    resident memory sampled while it runs (every 10 ms, in MB), so it does
+    not include the peaks of earlier runs of the same process (a reused
+    pool worker). Phases can be nested, their name is then the
+    path of the enclosing phases ('build/generators'). With profiler set to
+    'cprofile' or 'pyinstrument', each top-level phase is profiled and the
+    report is written in profile_directory. info holds the scenario
+    parameters and solver statistics written with the log.
+    """
+
+    def __init__(self, name: str = 'run', profiler: str = None, profile_directory: str = 'results/profiles'):
+        if profiler not in (None, 'cprofile', 'pyinstrument'):
+            raise ValueError(f'Unknown profiler {profiler}')
+        self.name = name
+        self.profiler = profiler
+        self.profile_directory = profile_directory
+        self.records = []
+        self.info = {}
+        self._stack = []
+        self._sampler = None
+
+    @contextmanager
+    def phase(self, name: str):
+        self._stack.append(name)
+        path = '/'.join(self._stack)
+        if len(self._stack) == 1:
+            self._sampler = _RssSampler()
+            self._sampler.start()
+        peak = [current_rss()]
+        with self._sampler.lock:
+            self._sampler.peaks.append(peak)
+        profiler = self._start_profiler() if len(self._stack) == 1 else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            if profiler is not None:
+                self._stop_profiler(profiler, name)
+            self._sampler.sample()
+            with self._sampler.lock:
+                self._sampler.peaks.pop()
+            if len(self._stack) == 1:
+                self._sampler.stopped.set()
+                self._sampler.join()
+                self._sampler = None
+            self._stack.pop()
+            self.records.append({'run': self.name, 'phase': path, 'duration': duration, 'peak_rss': peak[0]})
+
+    def _start_profiler(self):
+        if self.profiler == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif self.profiler == 'pyinstrument':
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+        else:
+            return None
+        return profiler
+
+    def _stop_profiler(self, profiler, phase: str):
+        os.makedirs(self.profile_directory, exist_ok=True)
+        path = os.path.join(self.profile_directory, f'{self.name}-{phase}'.replace(' ', '_'))
+        if self.profiler == 'cprofile':
+            profiler.disable()
+            profiler.dump_stats(path + '.prof')
+        else:
+            profiler.stop()
+            with open(path + '.html', 'w') as f:
+                f.write(profiler.output_html())
+
+    def durations(self) -> pd.Series:
+        """Total wall time of each phase, in seconds"""
+        return self.to_frame().groupby('phase', sort=False).duration.sum()
+
+    def to_frame(self) -> pd.DataFrame:
+        """One row per timed phase: run, phase, duration (s), peak_rss (peak resident
+        memory during the phase, MB)"""
+        return pd.DataFrame(self.records, columns=['run', 'phase', 'duration', 'peak_rss'])
+
+    def write(self, path: str):
+        """Write the log as JSON (records and info) or CSV (records, info as columns)"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if path.endswith('.csv'):
+            self.to_frame().assign(**self.info).to_csv(path, index=False)
+        else:
+            with open(path, 'w') as f:
+                json.dump({'run': self.name, 'info': self.info, 'phases': self.records}, f, indent=1, default=str)
+
+
+def read_logs(paths) -> pd.DataFrame:
+    """Gather the JSON run logs of a sweep in one DataFrame, with a column per info entry"""
+    frames = []
+    for path in paths:
+        with open(path) as f:
+            log = json.load(f)
+        frame = pd.DataFrame(log['phases'], columns=['run', 'phase', 'duration', 'peak_rss'])
+        frames.append(frame.assign(**{key: value for key, value in log['info'].items()
+                                      if not isinstance(value, (dict, list))}))
+    return pd.concat(frames, ignore_index=True)
@@ -2,7 +2,7 @@ from dispatch_optimization import ExistingBusElectricity
 import param
 import pandas as pd
 import matplotlib.pyplot as plt
-import utils
+import spectral
 import math
 
 installed_capa = {
@@ -35,6 +35,8 @@ france_net = ExistingBusElectricity(country, param.year, technologies=technologi
 
 # Optimize
 #france_net.add_co2_constraints(param.co2_limit_2030)
+# Dispatch of the installed fleet only, solved week by week with one day of look-ahead
+#france_net.rolling_dispatch(capacities=installed_capa, window=168, overlap=24)
 france_net.optimize()
 france_net.plot_duration_curve()
 start_date_winter=pd.Timestamp(f"{param.year}-01-05 00:00")
@@ -59,12 +61,8 @@ print(france_net.electricity_price)
 
 france_net.network.storage_units.to_csv("results/storage_without_constraints.csv")
 
-utils.fourier_transform([france_net.network.storage_units_t.p['PHS_b'],
-                         france_net.network.storage_units_t.p['PHS_s'],
-                         france_net.network.storage_units_t.p['Battery'],
-                         france_net.network.generators_t.p['PV'],
-                         france_net.network.generators_t.p['Wind Offshore'],
-                         france_net.network.generators_t.p['Hydro']]
-                         ,colors=[param.colors['PHS_b'], param.colors['PHS_s'], param.colors['Battery'],
-                                  param.colors["PV"], param.colors['Wind Offshore'], param.colors['Hydro']])
+spectrum = spectral.spectrum(france_net.network.storage_units_t.p[['PHS_b', 'PHS_s', 'Battery']].join(
+    france_net.network.generators_t.p[['PV', 'Wind Offshore', 'Hydro']]))
+print(spectral.band_energy(spectrum))
+spectral.plot_spectrum(spectrum, colors=param.colors)
 
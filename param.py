@@ -1,48 +1,228 @@
+import os
+import tempfile
+import zipfile
+import numpy as np
 import pandas as pd
 import utils
+from catalog import CostCatalog
+from hydro import HydroInflow
+
 # Load data
+# The weather, demand and hydrogen data are only parsed on first access of the
+# module attribute (see __getattr__ at the end of this file), and the parsed
+# frames are cached as .npz files keyed on the source file mtime and size, and
+# rebuilt when they were written by another reader.
+CACHE_DIR = 'data/cache'
+
+
+def _cache_path(path):
+    stat = os.stat(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(CACHE_DIR, f'{name}-{stat.st_mtime_ns:x}-{stat.st_size:x}.npz')
+
+
+def _load_cache(cache, reader, columns=None):
+    # None when the cache is missing, unreadable (e.g. cut short) or written by another reader
+    try:
+        with np.load(cache, allow_pickle=False) as data:
+            if 'reader' not in data.files or str(data['reader']) != reader.__name__:
+                return None
+            if data['index'].dtype.kind != 'M':  # Integer index of older caches, unit unknown
+                return None
+            index = pd.DatetimeIndex(data['index'], name=str(data['index_name']) or None)
+            if str(data['tz']):
+                index = index.tz_localize('UTC').tz_convert(str(data['tz']))
+            positions = {column: i for i, column in enumerate(data['columns'])}
+            if columns is None:
+                columns = list(positions)
+            return pd.DataFrame({column: data[f'c{positions[column]}'] for column in columns}, index=index)
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        return None
+
+
+def read_cached(path, reader, columns=None):
+    """Return reader(path), a DataFrame with a DatetimeIndex, through a binary
+    cache in CACHE_DIR. The cache is rebuilt whenever the source file or the
+    reader changes.
+    If columns is given, only these columns are read from the cache."""
+    cache = _cache_path(path)
+    df = _load_cache(cache, reader, columns)
+    if df is not None:
+        return df
+
+    df = reader(path)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    stale = os.path.basename(cache).rsplit('-', 2)[0] + '-'
+    for file in os.listdir(CACHE_DIR):
+        if file.startswith(stale) and file.endswith('.npz') and file != os.path.basename(cache):
+            try:
+                os.remove(os.path.join(CACHE_DIR, file))
+            except FileNotFoundError:  # Removed by another process
+                pass
+    arrays = {f'c{i}': df[column].to_numpy() for i, column in enumerate(df.columns)}
+    # Each process writes its own file and moves it in place in one step, so
+    # processes filling the cache at the same time never see a partial file
+    f = tempfile.NamedTemporaryFile(dir=CACHE_DIR, prefix=os.path.basename(cache), suffix='.tmp', delete=False)
+    try:
+        with f:
+            # datetime64 values keep their unit (ns, us...), unlike integers
+            np.savez(f, index=df.index.values, tz=str(df.index.tz or ''), reader=reader.__name__,
+                     index_name=str(df.index.name or ''),
+                     columns=np.array(df.columns, dtype=str), **arrays)
+        os.replace(f.name, cache)
+    except BaseException:
+        os.remove(f.name)
+        raise
+    # Round trip check of the index, the columns are stored as plain arrays
+    written = _load_cache(cache, reader, columns=[])
+    if written is None or not written.index.equals(df.index):
+        os.remove(cache)
+        raise RuntimeError(f'The cache of {path} does not read back the index of the data')
+    return df if columns is None else df[columns]
+
+
+def _read_time_series(path):
+    df = pd.read_csv(path, sep=';', index_col=0)
+    df.index = pd.to_datetime(df.index)
+    return df
+
+
+def _read_hydro_daily(path):
+    # Daily values, hourly ones are read through HydroInflow
+    df_hydro = pd.read_csv(path, sep=',')
+    df_hydro.index = pd.to_datetime(df_hydro[['Year', 'Month', 'Day']])
+    df_hydro['Inflow [GW]'] = df_hydro['Inflow [GWh]']/24  # Mean power of the day
+    df_hydro['Inflow pu'] = df_hydro['Inflow [GW]']/df_hydro['Inflow [GW]'].max()
+    return df_hydro
+
+
+def _read_industrial(path):
+    industrial_data = pd.read_csv(path)
+    industrial_data.index = pd.date_range(start='2015-01-01 00:00:00', end='2015-12-31 23:00:00', freq='h',
+                                          name='utc_time')
+    return industrial_data
+
+
+# Source files of the data loaded on first access
+data_files = {
+    'df_onshorewind': 'data/onshore_wind_1979-2017.csv',
+    'df_solar': 'data/pv_optimal.csv',
+    'df_offshorewind': 'data/offshore_wind_1979-2017.csv',
+    'df_hydro': 'data/Hydro_Inflow_FR.csv',
+    'demand': 'data/electricity_demand.csv',
+    'industrial_data': 'data/Industrial-1-shift Fabricated Metals.csv',
+}
+
 
 # CF
-df_onshorewind = pd.read_csv(
-    'data/onshore_wind_1979-2017.csv', sep=';', index_col=0)
-df_onshorewind.index = pd.to_datetime(df_onshorewind.index)
-df_solar = pd.read_csv('data/pv_optimal.csv', sep=';', index_col=0)
-df_solar.index = pd.to_datetime(df_solar.index)
-df_offshorewind = pd.read_csv(
-    'data/offshore_wind_1979-2017.csv', sep=';', index_col=0)
-df_offshorewind.index = pd.to_datetime(df_solar.index)
-df_hydro = pd.read_csv('data/Hydro_Inflow_FR.csv', sep=',')
-df_hydro.index = pd.to_datetime(df_hydro[['Year', 'Month', 'Day']])
-df_hydro = df_hydro.resample('h').ffill()
-df_hydro['Inflow [GW]'] = df_hydro['Inflow [GWh]']/24  # Hourly value
-df_hydro['Inflow pu'] = df_hydro['Inflow [GW]']/df_hydro['Inflow [GW]'].max()
-
-demand = pd.read_csv(
-    'data/electricity_demand.csv', sep=';', index_col=0)
-demand.index = pd.to_datetime(demand.index)
-demand = demand['FRA'].loc['2015']
-print(demand.sum())
+def _load_onshorewind():
+    return read_cached(data_files['df_onshorewind'], _read_time_series)
+
+
+def _load_solar():
+    return read_cached(data_files['df_solar'], _read_time_series)
+
+
+def _load_offshorewind():
+    return read_cached(data_files['df_offshorewind'], _read_time_series)
+
+
+def _load_hydro():
+    return read_cached(data_files['df_hydro'], _read_hydro_daily)
+
+
+_hydro_inflows = {}
+
+
+def hydro_inflow(data=None) -> HydroInflow:
+    """HydroInflow of the hydro data (passed to profile_data), with
+    hydro_reference_year and hydro_year_matched. The hour -> day index of
+    each year is built once per process for the default data."""
+    key = (data if isinstance(data, str) or data is None else id(data), hydro_reference_year, hydro_year_matched)
+    if key not in _hydro_inflows:
+        inflow = HydroInflow(profile_data('Hydro', data)['Inflow [GWh]'], hydro_reference_year, hydro_year_matched)
+        if not isinstance(data, pd.DataFrame):
+            _hydro_inflows[key] = inflow
+        return inflow
+    return _hydro_inflows[key]
+
+
+def _load_demand():
+    return read_cached(data_files['demand'], _read_time_series)['FRA'].loc['2015']
+
+
+def profile_data(technology: str, data=None) -> pd.DataFrame:
+    """Weather data of a technology. data is a DataFrame, the name of the param
+    attribute holding it, or None for profile_sources[technology]."""
+    if data is None:
+        data = profile_sources[technology]
+    if isinstance(data, str):
+        data = _lazy(data)
+    return data
+
+
+def capacity_factor(technology: str, country, year: int, data=None) -> np.ndarray:
+    """Return the hourly capacity factor of a technology in a country as a float
+    array aligned with utils.hours_in_year(year), with one column per country if
+    country is a list. data is passed to profile_data. Hydro uses the inflow
+    of hydro_reference_year, or of year with hydro_year_matched (see hydro_inflow)."""
+    if technology == 'Hydro':
+        return hydro_inflow(data).capacity_factor(year)
+    data = profile_data(technology, data)
+    return _aligned(data[country], utils.hours_in_year(year), f'{technology} data for {country}')
+
+
+def _aligned(series, hours, description):
+    """Values of series at the given hours, looked up by position"""
+    if series.index.tz is None:
+        hours = hours.tz_localize(None)
+    positions = series.index.get_indexer(hours)
+    if (positions < 0).any():
+        raise KeyError(f'Missing {description} in {hours[0].year}')
+    return series.to_numpy(dtype=float)[positions]
+
+
+# Electricity demand
+_demand_profiles = {}
+
+
+def electricity_demand(country: str, year: int) -> np.ndarray:
+    """Return the hourly electricity demand of a country in MWh as a read-only
+    array aligned with utils.hours_in_year(year). The demand file is parsed once
+    per process and only the requested countries and years are kept in memory.
+    Years missing from the file use the demand of demand_year."""
+    key = (country, year)
+    if key not in _demand_profiles:
+        series = read_cached(data_files['demand'], _read_time_series, columns=[country])[country]
+        if year not in series.index.year:
+            year = demand_year
+        profile = _aligned(series, utils.hours_in_year(year), f'{country} demand')
+        profile.flags.writeable = False
+        _demand_profiles[key] = profile
+    return _demand_profiles[key]
+
 
 #Hydrogen demand
-industrial_data = pd.read_csv('data/Industrial-1-shift Fabricated Metals.csv')
-industrial_data['utc_time'] = pd.date_range(start='2015-01-01 00:00:00', end='2015-12-31 23:00:00', freq='H')
-industrial_data.index = industrial_data['utc_time']
+def _load_industrial_data():
+    return read_cached(data_files['industrial_data'], _read_industrial)
+
+
+def _load_hourly_hydrogen_demand():
+    industrial_data = _lazy('industrial_data')
     #To find the hydrogen demand, we normalize by the total demand over a year, predicted for 2030: 35TWh.
-hourly_hydrogen_demand = industrial_data['Power [kW]']*35000000/industrial_data['Power [kW]'].sum() 
+    return industrial_data['Power [kW]']*35000000/industrial_data['Power [kW]'].sum()
 
 ### Costs
 costs = pd.read_csv('data/costs2030.csv', index_col='Technology')
-for key in costs.index:
-    costs.loc[key, 'CAPEX'] = utils.cost_conversion(
-        costs.loc[key, 'CAPEX'], costs.loc[key, 'Currency year'])
-    costs.loc[key, 'FOM'] = utils.cost_conversion(
-        costs.loc[key, 'FOM'], costs.loc[key, 'Currency year'])
-    costs.loc[key, 'VOM'] = utils.cost_conversion(
-        costs.loc[key, 'VOM'], costs.loc[key, 'Currency year'])
+costs[['CAPEX', 'FOM', 'VOM']] = utils.cost_conversion(
+    costs[['CAPEX', 'FOM', 'VOM']], costs['Currency year'].to_numpy()[:, None])
 
 # Costs storage
 costs_store = pd.read_csv('data/cost_storage2030.csv', index_col='Technology')
 
+# Network parameters of every technology
+cost_catalog = CostCatalog(costs, costs_store)
+
 #Costs hydrogen
 capex_electrolyser = utils.annuity(20, 0.07) * (641000 + 12000)
 capex_salt_cavern = utils.annuity(40, 0.07) * (350000 + 2000)
@@ -58,13 +238,31 @@ co2_limit_2030 = 12000000 #tCO2/year
 # Year simulation
 year = 2015
 
+# Weather data used for the capacity factor of each technology
+profile_sources = {
+    "PV": 'df_solar',
+    "Wind Onshore": 'df_onshorewind',
+    "Wind Offshore": 'df_offshorewind',
+    "Hydro": 'df_hydro',
+}
+hydro_reference_year = 2010
+# Use the hydro inflow of the simulated year when the record covers it
+# (2003-2012), else the inflow of hydro_reference_year
+hydro_year_matched = False
+# Countries of the hydro inflow data
+hydro_countries = ['FRA']
+# Only 2015 demand data are available, it is used for every simulated year
+demand_year = 2015
+
 # Technologies
+# Technologies with a capacity factor refer to their weather data by the name of
+# the param attribute holding it, so that it is only loaded when needed
 technologies_france = {
     "Nuclear": None,
-    "PV": df_solar,
-    "Wind Onshore": df_onshorewind,
-    "Wind Offshore": df_offshorewind,
-    "Hydro": df_hydro,
+    "PV": 'df_solar',
+    "Wind Onshore": 'df_onshorewind',
+    "Wind Offshore": 'df_offshorewind',
+    "Hydro": 'df_hydro',
     "OCGT": None,
     "CCGT": None,
     "TACH2": None,
@@ -84,16 +282,44 @@ country_coords = {
     'BEL': (50.85, 4.35),
     'DEU': (51.17, 10.45),
     'ITA': (42.83, 12.83),
-    'ESP': (40.40, -3.68)
+    'ESP': (40.40, -3.68),
+    'AUT': (47.52, 14.55),
+    'BGR': (42.73, 25.49),
+    'BIH': (43.92, 17.68),
+    'CHE': (46.82, 8.23),
+    'CYP': (35.13, 33.43),
+    'CZE': (49.82, 15.47),
+    'DNK': (56.26, 9.50),
+    'EST': (58.60, 25.01),
+    'FIN': (61.92, 25.75),
+    'GRC': (39.07, 21.82),
+    'HRV': (45.10, 15.20),
+    'HUN': (47.16, 19.50),
+    'IRL': (53.41, -8.24),
+    'LTU': (55.17, 23.88),
+    'LUX': (49.82, 6.13),
+    'LVA': (56.88, 24.60),
+    'NLD': (52.13, 5.29),
+    'NOR': (60.47, 8.47),
+    'POL': (51.92, 19.15),
+    'PRT': (39.40, -8.22),
+    'ROU': (45.94, 24.97),
+    'SRB': (44.02, 21.01),
+    'SVK': (48.67, 19.70),
+    'SVN': (46.15, 14.99),
+    'SWE': (60.13, 18.64),
 }
 
+# Countries without offshore wind
+landlocked_countries = ['AUT', 'BIH', 'CHE', 'CZE', 'HUN', 'LUX', 'SRB', 'SVK']
+
 technologies_by_country = {}
 
-for country in countries:
+for country in country_coords:
     if country == "ITA":
         technologies_by_country[country] = {
-            "PV": df_solar,
-            "Wind Onshore": df_onshorewind,
+            "PV": 'df_solar',
+            "Wind Onshore": 'df_onshorewind',
             "OCGT": None,
             "CCGT": None,
             "TACH2": None,
@@ -101,18 +327,18 @@ for country in countries:
     elif country == "BEL":
         technologies_by_country[country] = {
             "Nuclear": None,
-            "PV": df_solar,
-            "Wind Onshore": df_onshorewind,
-            "Wind Offshore": df_offshorewind,
+            "PV": 'df_solar',
+            "Wind Onshore": 'df_onshorewind',
+            "Wind Offshore": 'df_offshorewind',
             "OCGT": None,
             "CCGT": None,
             "TACH2": None,
         }
     elif country == "DEU":
         technologies_by_country[country] = {
-            "PV": df_solar,
-            "Wind Onshore": df_onshorewind,
-            "Wind Offshore": df_offshorewind,
+            "PV": 'df_solar',
+            "Wind Onshore": 'df_onshorewind',
+            "Wind Offshore": 'df_offshorewind',
             "OCGT": None,
             "CCGT": None,
             "TACH2": None,
@@ -120,8 +346,8 @@ for country in countries:
     elif country == "ESP":
         technologies_by_country[country] = {
             "Nuclear": None,
-            "PV": df_solar,
-            "Wind Onshore": df_onshorewind,
+            "PV": 'df_solar',
+            "Wind Onshore": 'df_onshorewind',
             "OCGT": None,
             "CCGT": None,
             "TACH2": None,
@@ -129,24 +355,36 @@ for country in countries:
     elif country == "GBR":
         technologies_by_country[country] = {
             "Nuclear": None,
-            "PV": df_solar,
-            "Wind Onshore": df_onshorewind,
-            "Wind Offshore": df_offshorewind,
+            "PV": 'df_solar',
+            "Wind Onshore": 'df_onshorewind',
+            "Wind Offshore": 'df_offshorewind',
+            "OCGT": None,
+            "CCGT": None,
+            "TACH2": None,
+        }
+    elif country == "FRA":
+        technologies_by_country[country] = {
+            "Nuclear": None,
+            "PV": 'df_solar',
+            "Wind Onshore": 'df_onshorewind',
+            "Wind Offshore": 'df_offshorewind',
+            "Hydro": 'df_hydro',
             "OCGT": None,
             "CCGT": None,
             "TACH2": None,
         }
     else:
+        # Hydro inflow is only known for France
         technologies_by_country[country] = {
             "Nuclear": None,
-            "PV": df_solar,
-            "Wind Onshore": df_onshorewind,
-            "Wind Offshore": df_offshorewind,
-            "Hydro": df_hydro if country == "FRA" else None,
+            "PV": 'df_solar',
+            "Wind Onshore": 'df_onshorewind',
             "OCGT": None,
             "CCGT": None,
             "TACH2": None,
         }
+        if country not in landlocked_countries:
+            technologies_by_country[country]["Wind Offshore"] = 'df_offshorewind'
 Distance_to_Paris = {
     'GBR': 350,
     'BEL': 265,
@@ -182,4 +420,32 @@ installed_capa = {
     "CCGT": 12.6*1000,
     "TACH2": 0,
     "Nuclear Extension" : 0
-}
\ No newline at end of file
+}
+
+
+_LAZY = {
+    'df_onshorewind': _load_onshorewind,
+    'df_solar': _load_solar,
+    'df_offshorewind': _load_offshorewind,
+    'df_hydro': _load_hydro,
+    'demand': _load_demand,
+    'industrial_data': _load_industrial_data,
+    'hourly_hydrogen_demand': _load_hourly_hydrogen_demand,
+}
+
+
+def _lazy(name):
+    if name not in globals():
+        globals()[name] = _LAZY[name]()
+    return globals()[name]
+
+
+def __getattr__(name):
+    """Load the data attributes listed in _LAZY on first access."""
+    if name in _LAZY:
+        return _lazy(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
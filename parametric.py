@@ -0,0 +1,85 @@
+import dataclasses
+import warnings
+import numpy as np
+import pandas as pd
+from solver import SolverConfig
+
+# Parametric analysis of the right-hand side of one constraint. An LP solved
+# by simplex keeps its optimal basis over an interval of the right-hand side,
+# given by the solver ranging; over this interval the objective is linear with
+# the dual as slope and the dispatch is linear as well. Solving at each end of
+# the intervals (the breakpoints) gives the exact piecewise-linear curves with
+# one solve per basis instead of a dense sweep.
+
+
+def rhs_range(model, name: str) -> tuple[float, float]:
+    """Interval of the right-hand side of constraint name (a single row) of a
+    linopy model solved by simplex over which the optimal basis is unchanged"""
+    label = int(model.constraints[name].labels.values.ravel()[0])
+    solver_model = model.solver_model
+    if hasattr(solver_model, 'getRanging'):  # HiGHS
+        status, ranging = solver_model.getRanging()
+        if status.name != 'kOk':
+            raise RuntimeError(f'No ranging for {name}: solve with simplex')
+        row = int(np.flatnonzero(model.matrices.clabels == label)[0])
+        return ranging.row_bound_dn.value_[row], ranging.row_bound_up.value_[row]
+    if hasattr(solver_model, 'getConstrByName'):  # Gurobi, rows are named after their label
+        constraint = solver_model.getConstrByName(f'c{label}')
+        return constraint.SARHSLow, constraint.SARHSUp
+    raise NotImplementedError(f'No ranging for {type(solver_model).__name__}')
+
+
+def co2_parametric(model, lower: float, upper: float, solver: SolverConfig = None,
+                   min_step: float = 0., max_solves: int = 100) -> pd.DataFrame:
+    """
+    Objective (EUR), CO2 price (EUR/tCO2), electricity price (mean of the
+    load-weighted price of the buses, EUR/MWh) and production of each carrier
+    (MWh) of model (a BusElectricity or NetworkElectricity with a co2_limit
+    constraint) at each breakpoint of the CO2 limit between upper and lower
+    (tCO2), one row per breakpoint by decreasing CO2 limit, ending at lower.
+    Each row is solved just under the breakpoint of the previous one, so the
+    objective and production are linear between consecutive rows and the
+    prices are those of the row above; with min_step, breakpoints
+    closer than min_step to the previous row are skipped and the curves are
+    interpolated over them. The model is built once and re-solved with
+    simplex, warm started from the previous basis; basis_low and basis_high
+    are the interval of the CO2 limit of the basis of each row. The CO2
+    limit of the model is restored at the end.
+    If max_solves runs out or a solve fails before lower, the curve stops
+    early with a RuntimeWarning; attrs['co2_reached'] of the result is the
+    lowest CO2 limit solved.
+    """
+    solver = dataclasses.replace(solver or SolverConfig(), method='simplex')
+    network = model.network
+    initial = network.global_constraints.at['co2_limit', 'constant']
+    model.build_model()
+    tolerance = 1e-9*max(abs(upper), abs(lower), 1.)
+    rows = []
+    limit = upper
+    status, condition = 'ok', None
+    try:
+        while len(rows) < max_solves:
+            model.update_co2_limit(limit)
+            status, condition = model.resolve(solver)
+            if status != 'ok':
+                break
+            low, high = rhs_range(network.model, 'GlobalConstraint-co2_limit')
+            summary = model.summary()
+            production = summary['generators'].groupby('carrier').energy.sum()
+            rows.append({'co2_limit': limit, 'objective': network.objective,
+                         'co2_price': -network.global_constraints.at['co2_limit', 'mu'],
+                         'electricity_price': summary['price'].mean(),
+                         'basis_low': low, 'basis_high': high, **production})
+            if limit <= lower + tolerance:
+                break
+            # At the breakpoint itself the solver may return either basis
+            limit = max(lower, min(low, limit - min_step) - max(tolerance, 1e-6*abs(low)))
+    finally:
+        model.update_co2_limit(initial)
+    results = pd.DataFrame(rows).set_index('co2_limit')
+    results.attrs['co2_reached'] = float(results.index[-1]) if rows else None
+    if not rows or results.index[-1] > lower + tolerance:
+        reason = f'solve failed ({condition})' if status != 'ok' else f'max_solves={max_solves} reached'
+        warnings.warn(f'CO2 parametric curve stopped at {results.attrs["co2_reached"]} tCO2 instead of '
+                      f'{lower} tCO2: {reason}', RuntimeWarning, stacklevel=2)
+    return results
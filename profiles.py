@@ -0,0 +1,109 @@
+import json
+import os
+import numpy as np
+import param
+
+# Capacity factors of every weather year, stored as a float32 array indexed
+# (technology, country, year, hour of year) and read through a memory map, so
+# that processes running a sweep share the pages through the OS page cache.
+CUBE_PATH = os.path.join(param.CACHE_DIR, 'profiles.npy')
+
+
+def _sources(technologies):
+    """Modification time and size of the source file of each technology"""
+    sources = {}
+    for technology in technologies:
+        path = param.data_files[param.profile_sources[technology]]
+        stat = os.stat(path)
+        sources[path] = [stat.st_mtime_ns, stat.st_size]
+    return sources
+
+
+def _hydro_settings():
+    return [param.hydro_reference_year, param.hydro_year_matched, param.hydro_countries]
+
+
+def build_cube(technologies=None, countries=None, years=None, path=CUBE_PATH):
+    """Write the capacity factors of technologies for countries and years to
+    path, with the labels of each axis in a .json file next to it. Countries
+    and years missing from the weather data, and the hydro inflow of countries
+    other than param.hydro_countries, are stored as NaN."""
+    technologies = list(technologies or param.profile_sources)
+    frames = {technology: param.profile_data(technology) for technology in technologies}
+    if countries is None:
+        countries = sorted(set().union(*(frame.columns for technology, frame in frames.items()
+                                         if technology != 'Hydro')))
+    if years is None:
+        years = sorted(set().union(*(frame.index.year for technology, frame in frames.items()
+                                     if technology != 'Hydro')))
+    countries, years = list(countries), [int(year) for year in years]
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cube = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=np.float32,
+                                     shape=(len(technologies), len(countries), len(years), 8760))
+    for t, technology in enumerate(technologies):
+        data = frames[technology]
+        if technology != 'Hydro':
+            data = data.reindex(columns=countries)
+        for y, year in enumerate(years):
+            try:
+                if technology != 'Hydro':
+                    cube[t, :, y, :] = param.capacity_factor(technology, countries, year, data).T
+                    continue
+                # The inflow is that of the hydro countries only
+                cube[t, :, y, :] = np.nan
+                inflow = param.capacity_factor(technology, None, year, data)
+                for c, country in enumerate(countries):
+                    if country in param.hydro_countries:
+                        cube[t, c, y, :] = inflow
+            except KeyError:
+                cube[t, :, y, :] = np.nan
+    cube.flush()
+    del cube
+    os.replace(path + '.tmp', path)
+
+    with open(os.path.splitext(path)[0] + '.json', 'w') as f:
+        json.dump({'technologies': technologies, 'countries': countries, 'years': years,
+                   'sources': _sources(technologies), 'hydro': _hydro_settings()}, f)
+    return ProfileCube(path)
+
+
+def load_cube(path=CUBE_PATH):
+    """Return the profile cube at path, (re)building it if it is missing,
+    older than the weather data or built with other hydro settings"""
+    meta_path = os.path.splitext(path)[0] + '.json'
+    if os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta['sources'] == _sources(meta['technologies']) and meta.get('hydro') == _hydro_settings():
+            return ProfileCube(path)
+    return build_cube(path=path)
+
+
+class ProfileCube():
+    def __init__(self, path=CUBE_PATH):
+        with open(os.path.splitext(path)[0] + '.json') as f:
+            meta = json.load(f)
+        self.path = path
+        self.technologies = meta['technologies']
+        self.countries = meta['countries']
+        self.years = meta['years']
+        self._technology = {technology: i for i, technology in enumerate(self.technologies)}
+        self._country = {country: i for i, country in enumerate(self.countries)}
+        self._year = {year: i for i, year in enumerate(self.years)}
+        self.data = np.load(path, mmap_mode='r')
+
+    def __reduce__(self):
+        # Worker processes reopen the memory map instead of copying the data
+        return (ProfileCube, (self.path,))
+
+    def profile(self, technology: str, country: str, year: int) -> np.ndarray:
+        """Read-only view of the 8760 hourly capacity factors of a technology
+        in a country for a weather year"""
+        try:
+            profile = self.data[self._technology[technology], self._country[country], self._year[year]]
+        except KeyError:
+            raise KeyError(f'{technology}, {country}, {year} is not in the profile cube') from None
+        if np.isnan(profile[0]):
+            raise KeyError(f'Missing {technology} data for {country} in {year}')
+        return profile
@@ -0,0 +1,147 @@
+import time
+import numpy as np
+import pandas as pd
+import pypsa
+from solver import SolverConfig, iteration_counts
+
+# Static table and nominal attribute of the components whose capacity can be
+# expanded
+NOMINAL_ATTRIBUTES = (('generators', 'p_nom'), ('storage_units', 'p_nom'), ('links', 'p_nom'),
+                      ('stores', 'e_nom'), ('lines', 's_nom'), ('transformers', 's_nom'))
+
+
+def _generator_emissions(network: pypsa.Network, attribute: str) -> np.ndarray:
+    """Emissions (attribute of the carriers) of the generators in each snapshot"""
+    if attribute not in network.carriers:
+        return np.zeros(len(network.snapshots))
+    generators = network.generators
+    p = network.generators_t.p.reindex(index=network.snapshots, columns=generators.index, fill_value=0.)
+    specific = generators.carrier.map(network.carriers[attribute]).fillna(0.)/generators.efficiency
+    return network.snapshot_weightings.generators.to_numpy()*(p.to_numpy() @ specific.to_numpy())
+
+
+def _storage_emissions(network: pypsa.Network, attribute: str, start: tuple, end: tuple) -> float:
+    """Emissions of the change of level of the storage units and stores from
+    the levels start to the levels end (state of charge, e)"""
+    if attribute not in network.carriers:
+        return 0.
+    total = 0.
+    for static, level_start, level_end in zip((network.storage_units, network.stores), start, end):
+        total += ((level_start - level_end)*static.carrier.map(network.carriers[attribute]).fillna(0.)).sum()
+    return float(total)
+
+
+class RollingHorizon():
+    """
+    Dispatch of a network with fixed capacities, solved window by window:
+    each LP covers window hours plus overlap hours of look-ahead, only the
+    first window hours are kept and the next LP starts from the state of
+    charge of the storage at the end of them. The LPs are small, so the peak
+    memory is much lower than with the full year as one LP.
+    Primary energy global constraints (the CO2 limit) cap the whole horizon.
+    The windows are first solved without them; if the emissions go over a
+    cap, they are solved again with each LP limited to the budget left after
+    the kept hours before it, times the share of its hours in the emissions
+    left in the first pass. Emissions cannot move between windows as in a
+    single LP, so the cost is at least that of the capped fixed-capacity
+    optimum.
+    """
+
+    def __init__(self, window: int = 168, overlap: int = 24):
+        if window < 1 or overlap < 0:
+            raise ValueError('window must be positive and overlap non-negative')
+        self.window = window
+        self.overlap = overlap
+
+    def __repr__(self):
+        return f'RollingHorizon({self.window}, {self.overlap})'
+
+    def cache_key(self) -> tuple:
+        """Window and overlap, hashed by SolveCache"""
+        return ('RollingHorizon', self.window, self.overlap)
+
+    def dispatch(self, network: pypsa.Network, solver: SolverConfig = None) -> dict:
+        """Solve every window of network in chronological order, and return the
+        solve statistics summed over the windows and passes with the objective
+        (operational cost of the kept hours, as for an optimize with fixed
+        capacities, EUR) and the total system cost (capital and operational,
+        EUR)"""
+        solver = solver or SolverConfig()
+        global_constraints = network.global_constraints
+        other = global_constraints.index[global_constraints.type != 'primary_energy']
+        if len(other):
+            raise ValueError(f'Rolling horizon dispatch only caps primary energy, not {", ".join(other)}')
+        # Each window would size the extendable assets with a full year of
+        # capital cost
+        extendable = [name for component, attribute in NOMINAL_ATTRIBUTES
+                      for name in getattr(network, component).index[getattr(network, component)[
+                          f'{attribute}_extendable']]]
+        if extendable:
+            raise ValueError(f'Rolling horizon dispatch needs fixed capacities, {", ".join(extendable)} '
+                             f'can be expanded')
+        storage_units, stores = network.storage_units, network.stores
+        cyclic = storage_units.cyclic_state_of_charge.copy(), stores.e_cyclic.copy()
+        initial = storage_units.state_of_charge_initial.copy(), stores.e_initial.copy()
+        caps = global_constraints.constant.copy()
+        storage_units['cyclic_state_of_charge'] = False
+        stores['e_cyclic'] = False
+        stats = {'backend': solver.backend, 'status': 'ok', 'condition': 'optimal', 'wall_time': 0.,
+                 'windows': 0, 'passes': 1}
+        try:
+            global_constraints['constant'] = np.inf
+            emissions = self._solve_windows(network, solver, stats)
+            if stats['status'] == 'ok' and (emissions > caps).any():
+                storage_units['state_of_charge_initial'], stores['e_initial'] = initial
+                profiles = {name: _generator_emissions(network, attribute)
+                            for name, attribute in global_constraints.carrier_attribute.items()}
+                stats['passes'] = 2
+                self._solve_windows(network, solver, stats, caps, profiles)
+        finally:
+            storage_units['cyclic_state_of_charge'], stores['e_cyclic'] = cyclic
+            storage_units['state_of_charge_initial'], stores['e_initial'] = initial
+            global_constraints['constant'] = caps
+        # Objective of the whole dispatch as a fixed-capacity optimize gives it:
+        # the operational cost of the kept hours, the overlap hours are solved
+        # again by the next window
+        stats['objective'] = network.statistics.opex().sum()
+        stats['total_system_cost'] = network.statistics.capex().sum() + stats['objective']
+        return stats
+
+    def _solve_windows(self, network: pypsa.Network, solver: SolverConfig, stats: dict,
+                       caps: pd.Series = None, profiles: dict = None) -> pd.Series:
+        """Solve the windows one after the other, with the global constraints
+        split by the emission profiles if caps is given, and return the
+        emissions of the kept hours for each global constraint"""
+        global_constraints = network.global_constraints
+        storage_units, stores = network.storage_units, network.stores
+        snapshots = network.snapshots
+        emitted = pd.Series(0., index=global_constraints.index)
+        # Emissions of the first pass still to come from each snapshot
+        after = {name: np.append(np.cumsum(profile[::-1])[::-1], 0.) for name, profile in (profiles or {}).items()}
+        for start in range(0, len(snapshots), self.window):
+            end = min(start + self.window, len(snapshots))
+            stop = min(end + self.overlap, len(snapshots))
+            if caps is not None:
+                for name, left in after.items():
+                    share = (left[start] - left[stop])/left[start] if left[start] > 0 else 1.
+                    global_constraints.loc[name, 'constant'] = max(caps[name] - emitted[name], 0.)*share
+            levels = storage_units.state_of_charge_initial.copy(), stores.e_initial.copy()
+            start_time = time.perf_counter()
+            status, condition = network.optimize(snapshots=snapshots[start:stop],
+                                                 solver_name=solver.backend, solver_options=solver.solver_options())
+            stats['wall_time'] += time.perf_counter() - start_time
+            stats['windows'] += 1
+            # Iterations of this window's solve, 0 when presolve solves it
+            for name, value in iteration_counts(network.model).items():
+                stats[name] = stats.get(name, 0) + value
+            if status != 'ok':
+                stats.update(status=status, condition=condition)
+                break
+            # State of charge at the end of the kept hours starts the next window
+            last = snapshots[end - 1]
+            storage_units['state_of_charge_initial'] = network.storage_units_t.state_of_charge.loc[last]
+            stores['e_initial'] = network.stores_t.e.loc[last]
+            for name, attribute in global_constraints.carrier_attribute.items():
+                emitted[name] += _generator_emissions(network, attribute)[start:end].sum() + _storage_emissions(
+                    network, attribute, levels, (storage_units.state_of_charge_initial, stores.e_initial))
+        return emitted
@@ -2,7 +2,7 @@ from dispatch_optimization import BusElectricity
 import param
 import pandas as pd
 import matplotlib.pyplot as plt
-import utils
+import spectral
 
 country = 'FRA'
 #france_net = BusElectricity(country, param.year, technologies=param.technologies_france)
@@ -54,14 +54,10 @@ print(france_net.network.buses_t.marginal_price.mean())
 
 france_net.network.storage_units.to_csv("results/storage_without_constraints.csv")
 
-utils.fourier_transform([france_net.network.storage_units_t.p['PHS_b'],
-                         france_net.network.storage_units_t.p['PHS_s'],
-                         france_net.network.storage_units_t.p['Battery'],
-                         france_net.network.generators_t.p['PV'],
-                         france_net.network.generators_t.p['Wind Offshore'],
-                         france_net.network.generators_t.p['Hydro']]
-                         ,colors=[param.colors['PHS_b'], param.colors['PHS_s'], param.colors['Battery'],
-                                  param.colors["PV"], param.colors['Wind Offshore'], param.colors['Hydro']])
+spectrum = spectral.spectrum(france_net.network.storage_units_t.p[['PHS_b', 'PHS_s', 'Battery']].join(
+    france_net.network.generators_t.p[['PV', 'Wind Offshore', 'Hydro']]))
+print(spectral.band_energy(spectrum))
+spectral.plot_spectrum(spectrum, colors=param.colors)
 
 
 #print([generator for generator in france_net.network.generators.loc[france_net.network.generators.p_nom_opt !=0].index])
@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import pandas as pd
+import linopy
+import xarray as xr
+import numpy as np
+import pypsa
+from pypsa.optimization.optimize import define_objective
+from pypsa.optimization.window import SnapshotWindow
+from solver import SolverConfig
+
+# Version of pypsa whose model building state ModelCache restores (see
+# requirements.txt)
+MODEL_PYPSA_VERSION = '1.4.'
+
+
+def _hash_inputs(digest, network: pypsa.Network, skip: dict = None):
+    """Add the inputs of the network to digest, except the attributes skip
+    gives for each component, of which only the names of the columns with
+    time-varying values are hashed"""
+    skip = skip or {}
+    digest.update(pd.util.hash_pandas_object(network.snapshot_weightings).values.tobytes())
+    for component in network.iterate_components():
+        attrs = network.components[component.name].defaults
+        inputs = attrs.index[attrs.status != 'Output'].difference(skip.get(component.name, []))
+        static = getattr(network, component.list_name)
+        static = static[static.columns.intersection(inputs)]
+        digest.update(component.name.encode())
+        digest.update(','.join(static.columns).encode())
+        digest.update(pd.util.hash_pandas_object(static.astype(str)).values.tobytes())
+        for attr, dynamic in getattr(network, f'{component.list_name}_t').items():
+            if not dynamic.empty and attr in attrs.index and attrs.status[attr] != 'Output':
+                digest.update(f'{attr}:{",".join(dynamic.columns)}'.encode())
+                if attr in inputs:
+                    digest.update(pd.util.hash_pandas_object(dynamic).values.tobytes())
+
+
+class SolveCache():
+    """
+    On-disk cache of solved networks, keyed by a hash of every input of the
+    network and of the solver settings. Solved networks are stored as NetCDF
+    files and the least recently used ones are removed once the cache grows
+    over max_size bytes.
+    """
+
+    def __init__(self, directory: str = 'results/cache', max_size: float = 5e9):
+        self.directory = directory
+        self.max_size = max_size
+
+    def key(self, network: pypsa.Network, solver_name: str, solver_options: dict = None, aggregation=None) -> str:
+        """Hash of the inputs of the network (outputs of a previous solve are
+        ignored), of the solver and of the settings of the aggregation or
+        rolling horizon (their cache_key)"""
+        digest = hashlib.sha256()
+        settings = None if aggregation is None else aggregation.cache_key()
+        digest.update(json.dumps([solver_name, solver_options or {}, settings],
+                                 sort_keys=True, default=str).encode())
+        _hash_inputs(digest, network)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.nc')
+
+    def get(self, key: str):
+        """Solved network stored under key and its objective (EUR), or None"""
+        path = self._path(key)
+        if not os.path.exists(path) or not os.path.exists(path[:-3] + '.json'):
+            return None
+        os.utime(path)  # Most recently used
+        # The objective is read from the record, the network does not store it
+        with open(path[:-3] + '.json') as f:
+            objective = json.load(f)['objective']
+        return pypsa.Network(path), objective
+
+    def put(self, key: str, network: pypsa.Network, objective: float):
+        """Store a solved network and its objective (EUR) under key, then
+        evict the least recently used networks"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        with open(path[:-3] + '.json', 'w') as f:
+            json.dump({'objective': float(objective)}, f)
+        network.export_to_netcdf(path + '.tmp')
+        os.replace(path + '.tmp', path)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries (stored file and its .json
+        sidecar, counted together) until the cache is at most max_size bytes"""
+        files = os.listdir(self.directory)
+        entries = [os.path.join(self.directory, file[:-3]) for file in files if file.endswith('.nc')]
+        # Sidecars left without their network are removed
+        for file in files:
+            if file.endswith('.json') and file[:-5] + '.nc' not in files:
+                os.remove(os.path.join(self.directory, file))
+
+        def size(entry):
+            return sum(os.path.getsize(entry + extension) for extension in ('.nc', '.json')
+                       if os.path.exists(entry + extension))
+
+        entries.sort(key=lambda entry: os.path.getmtime(entry + '.nc'))
+        sizes = [size(entry) for entry in entries]
+        total = sum(sizes)
+        for entry, entry_size in zip(entries, sizes):
+            if total <= self.max_size:
+                break
+            total -= entry_size
+            for extension in ('.nc', '.json'):
+                if os.path.exists(entry + extension):
+                    os.remove(entry + extension)
+
+
+class ModelCache(SolveCache):
+    """
+    On-disk cache of built linopy models, keyed by a hash of the structure of
+    the network: every input except the costs, the global constraint
+    constants, the load and the generator availability, which are patched on
+    a cached model instead of building it again. Models are stored as NetCDF
+    files, with the names of their variables and constraints, and the least
+    recently used ones are removed once the cache grows over max_size bytes.
+    """
+
+    # Inputs written on the cached model rather than hashed
+    patched = {
+        **{component: ['capital_cost', 'marginal_cost', 'marginal_cost_storage', 'spill_cost']
+           for component in ('Generator', 'StorageUnit', 'Store', 'Link', 'Line', 'Transformer')},
+        'Generator': ['capital_cost', 'marginal_cost', 'p_max_pu'],
+        'Load': ['p_set'],
+        'GlobalConstraint': ['constant'],
+    }
+
+    def __init__(self, directory: str = 'results/models', max_size: float = 5e9):
+        if not pypsa.__version__.startswith(MODEL_PYPSA_VERSION):
+            raise RuntimeError(f'ModelCache needs pypsa {MODEL_PYPSA_VERSION}x, not {pypsa.__version__}')
+        super().__init__(directory, max_size)
+
+    def key(self, network: pypsa.Network, snapshots=None) -> str:
+        """Hash of the structure of the network and of the snapshots modelled"""
+        digest = hashlib.sha256()
+        digest.update(','.join(map(str, network.snapshots if snapshots is None else snapshots)).encode())
+        _hash_inputs(digest, network, self.patched)
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """Model stored under key, or None"""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)  # Most recently used
+        return linopy.read_netcdf(path)
+
+    def put(self, key: str, model: linopy.Model):
+        """Store a model under key, then evict the least recently used models"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        model.to_netcdf(path + '.tmp')
+        os.replace(path + '.tmp', path)
+        self.evict()
+
+    def create_model(self, network: pypsa.Network, snapshots=None) -> linopy.Model:
+        """Model of the network, like network.optimize.create_model: loaded
+        from the cache and patched with the current inputs of the network when
+        its structure was built before, else built and stored"""
+        key = self.key(network, snapshots)
+        model = self.get(key)
+        if model is None:
+            model = network.optimize.create_model(snapshots=snapshots,
+                                                  include_objective_constant=self._objective_constant())
+            self.put(key, model)
+            return model
+        self._attach(network, model)
+        self.patch(network)
+        return model
+
+    def verify(self, network: pypsa.Network, snapshots=None, solver: SolverConfig = None, rtol: float = 1e-6):
+        """Solve copies of the network with its cached model, patched, and with a
+        model built by network.optimize.create_model, and raise RuntimeError if
+        their objective or generator dispatch differ by more than rtol: a check
+        of patch against the installed pypsa and linopy"""
+        solver = solver or SolverConfig()
+        if self.get(self.key(network, snapshots)) is None:
+            self.create_model(network.copy(), snapshots)
+        solutions = []
+        for cached in (True, False):
+            copy = network.copy()
+            if cached:
+                self.create_model(copy, snapshots)
+            else:
+                copy.optimize.create_model(snapshots=snapshots, include_objective_constant=self._objective_constant())
+            status, condition = copy.optimize.solve_model(solver_name=solver.backend,
+                                                          solver_options=solver.solver_options())
+            if status != 'ok':
+                raise RuntimeError(f'ModelCache check failed to solve: {condition}')
+            solutions.append((copy.objective, copy.generators_t.p))
+        (objective, dispatch), (expected, expected_dispatch) = solutions
+        if not np.isclose(objective, expected, rtol=rtol, atol=0.):
+            raise RuntimeError(f'Patched cached model gives an objective of {objective}, not {expected}')
+        scale = max(expected_dispatch.abs().to_numpy().max(initial=0.), 1.)
+        if not np.allclose(dispatch.to_numpy(), expected_dispatch[dispatch.columns].to_numpy(), rtol=0., atol=rtol*scale):
+            raise RuntimeError('Patched cached model gives another generator dispatch')
+
+    @staticmethod
+    def _objective_constant() -> bool:
+        # Default of create_model, without its warning
+        include = pypsa.options.params.optimize.include_objective_constant
+        return True if include is None else include
+
+    @staticmethod
+    def _attach(network: pypsa.Network, model: linopy.Model):
+        # pypsa has no public API to give a network a model built elsewhere:
+        # set the state network.optimize.create_model sets before building,
+        # for a single-period model without unit commitment
+        network._linearized_uc = 0
+        network._multi_invest = 0
+        network._committable_big_m = None
+        network._optimize_window = SnapshotWindow.build(
+            network, model.parameters.snapshots.to_index(), pypsa.options.optimization.model_snapshot_index)
+        network._model = model
+
+    def patch(self, network: pypsa.Network):
+        """Write the patched inputs of the network on its model: objective,
+        global constraint constants, nodal balance right-hand side (load) and
+        generator availability"""
+        model = network.model
+        snapshots = model.parameters.snapshots.to_index()
+        if 'objective_constant' in model.variables:
+            model.remove_variables('objective_constant')
+        define_objective(network, snapshots, self._objective_constant(), [])
+
+        for name, constant in network.global_constraints.constant.items():
+            if f'GlobalConstraint-{name}' in model.constraints:
+                model.constraints[f'GlobalConstraint-{name}'].rhs = constant
+
+        loads = network.loads[network.loads.active]
+        load = (network.get_switchable_as_dense('Load', 'p_set', snapshots)[loads.index]*loads.sign).T.groupby(
+            loads.bus).sum().T
+        balance = model.constraints['Bus-nodal_balance']
+        buses = balance.rhs.dims[1]
+        balance.rhs = -xr.DataArray(load.reindex(columns=balance.rhs.indexes[buses], fill_value=0.).rename_axis(
+            index='snapshot', columns=buses))
+
+        # Dispatch limits of the generators: p - p_max_pu*p_nom <= 0 for the
+        # extendable ones (the capacity is the second term), p <= p_max_pu*p_nom
+        # for the others
+        p_max_pu = network.get_switchable_as_dense('Generator', 'p_max_pu', snapshots).rename_axis(
+            index='snapshot', columns=None)
+        if 'Generator-ext-p-upper' in model.constraints:
+            upper = model.constraints['Generator-ext-p-upper']
+            coeffs = upper.coeffs.copy()
+            names = upper.rhs.dims[1]
+            # The capacity must be the second term, as pypsa builds it
+            p_nom = model.variables['Generator-p_nom'].labels.sel({names: upper.rhs.indexes[names]})
+            if not (upper.vars.isel(_term=1) == p_nom).all():
+                raise RuntimeError('Generator-ext-p-upper has another layout in this pypsa version')
+            coeffs[{'_term': 1}] = -xr.DataArray(p_max_pu[upper.rhs.indexes[names]].rename_axis(
+                columns=names)).transpose(*coeffs.isel(_term=1).dims)
+            upper.coeffs = coeffs
+        if 'Generator-fix-p-upper' in model.constraints:
+            upper = model.constraints['Generator-fix-p-upper']
+            names = upper.rhs.dims[1]
+            index = upper.rhs.indexes[names]
+            upper.rhs = xr.DataArray((p_max_pu[index]*network.generators.p_nom[index]).rename_axis(
+                columns=names)).transpose(*upper.rhs.dims)
@@ -0,0 +1,68 @@
+from dataclasses import dataclass, field
+
+
+@dataclass
+class SolverConfig():
+    """
+    Solver used to optimize the networks, and its main options:
+    - backend: solver name given to linopy ('highs', 'gurobi', ...)
+    - threads: number of threads, None for the solver default
+    - method: 'ipm' (interior point/barrier) or 'simplex', None for the solver default
+    - crossover: run crossover after the interior point method
+    - tolerance: primal/dual feasibility and optimality tolerance
+    - time_limit: in seconds
+    - options: any other option, passed to the solver as is
+    """
+    backend: str = 'highs'
+    threads: int = None
+    method: str = None
+    crossover: bool = True
+    tolerance: float = None
+    time_limit: float = None
+    options: dict = field(default_factory=dict)
+
+    def solver_options(self) -> dict:
+        """Options of the configuration, named as the backend expects them"""
+        options = {}
+        if self.backend == 'highs':
+            if self.threads is not None:
+                options['threads'] = self.threads
+            if self.method is not None:
+                options['solver'] = self.method
+            if self.method == 'ipm':
+                options['run_crossover'] = 'on' if self.crossover else 'off'
+            if self.tolerance is not None:
+                options.update(primal_feasibility_tolerance=self.tolerance,
+                               dual_feasibility_tolerance=self.tolerance,
+                               ipm_optimality_tolerance=self.tolerance)
+            if self.time_limit is not None:
+                options['time_limit'] = self.time_limit
+        elif self.backend == 'gurobi':
+            if self.threads is not None:
+                options['Threads'] = self.threads
+            if self.method is not None:
+                options['Method'] = {'ipm': 2, 'simplex': 1}[self.method]
+            if not self.crossover:
+                options['Crossover'] = 0
+            if self.tolerance is not None:
+                options.update(FeasibilityTol=self.tolerance, OptimalityTol=self.tolerance,
+                               BarConvTol=self.tolerance)
+            if self.time_limit is not None:
+                options['TimeLimit'] = self.time_limit
+        return {**options, **self.options}
+
+
+def iteration_counts(model) -> dict:
+    """Simplex, barrier and crossover iterations of the last solve of a linopy model"""
+    solver_model = getattr(model, 'solver_model', None)
+    if solver_model is None:
+        return {}
+    if hasattr(solver_model, 'getInfo'):  # HiGHS
+        info = solver_model.getInfo()
+        return {'simplex_iterations': info.simplex_iteration_count,
+                'barrier_iterations': info.ipm_iteration_count,
+                'crossover_iterations': info.crossover_iteration_count}
+    if hasattr(solver_model, 'IterCount'):  # Gurobi
+        return {'simplex_iterations': int(solver_model.IterCount),
+                'barrier_iterations': int(solver_model.BarIterCount)}
+    return {}
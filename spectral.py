@@ -0,0 +1,89 @@
+import math
+import numpy as np
+import pandas as pd
+from scipy import signal
+from dispatch_optimization import _figure, _show
+
+# Spectral analysis of hourly time series (storage, generator and link
+# dispatch). Series are stacked as the columns of one 2-D array so that one
+# rfft (or Welch PSD) along the time axis covers all of them, e.g. every
+# storage unit of hundreds of scenario runs.
+
+# Cycling bands, as [shortest, longest) period in hours
+BANDS = {'intraday': (0, 12), 'daily': (12, 48), 'weekly': (48, 24*14), 'seasonal': (24*14, np.inf)}
+
+
+def network_series(network) -> pd.DataFrame:
+    """Dispatch of the storage units, generators and links (p0) of a solved
+    network, with columns (component, name)"""
+    return pd.concat({'StorageUnit': network.storage_units_t.p,
+                      'Generator': network.generators_t.p,
+                      'Link': network.links_t.p0}, axis=1, names=['component', 'name'])
+
+
+def spectrum(data: pd.DataFrame, method: str = 'fft', sampling: float = 1., nperseg: int = None) -> pd.DataFrame:
+    """
+    Power spectrum of every column of data (rows are time steps, sampling
+    hours apart), as a tidy table with the column levels of data and
+    frequency (1/h), period (h) and power. method is 'fft' (one rfft of the
+    whole series, mean removed) or 'welch' (PSD averaged over segments of
+    nperseg steps, one week by default). The zero frequency is left out.
+    Scenarios are stacked with pd.concat({scenario: network_series(n)}, axis=1).
+    """
+    values = data.to_numpy(dtype=float)
+    if method == 'fft':
+        n = len(values)
+        frequency = np.fft.rfftfreq(n, d=sampling)
+        power = np.abs(np.fft.rfft(values - values.mean(axis=0), axis=0))**2/n
+    elif method == 'welch':
+        frequency, power = signal.welch(values, fs=1/sampling, nperseg=nperseg or min(len(values), int(168/sampling)),
+                                        axis=0)
+    else:
+        raise ValueError(f'Unknown method {method}')
+    frequency, power = frequency[1:], power[1:]
+    columns = data.columns.to_frame(index=False)
+    columns.columns = [name if name is not None else 'name' for name in data.columns.names]
+    table = columns.loc[np.repeat(columns.index, len(frequency))].reset_index(drop=True)
+    return table.assign(frequency=np.tile(frequency, len(columns)),
+                        period=np.tile(1/frequency, len(columns)),
+                        power=power.T.ravel())
+
+
+def band_energy(table: pd.DataFrame, bands: dict = BANDS) -> pd.DataFrame:
+    """Share of the power of each series of a spectrum table in each band,
+    with one row per series and one column per band"""
+    edges = sorted({edge for band in bands.values() for edge in band})
+    labels = pd.cut(table.period, edges, right=False)
+    keys = [column for column in table.columns if column not in ('frequency', 'period', 'power')]
+    # Only the series present in table, every band kept even when empty
+    energy = table.power.groupby([table[key] for key in keys] + [labels], sort=False, observed=True).sum().unstack()
+    energy = energy.rename(columns={pd.Interval(*band, closed='left'): name for name, band in bands.items()})
+    energy = energy.reindex(columns=list(bands), fill_value=0.)
+    return energy.div(energy.sum(axis=1), axis=0)
+
+
+def plot_spectrum(table: pd.DataFrame, colors: dict = None, max_columns: int = 3, path: str = None, fig=None):
+    """Amplitude spectrum (square root of the power) of each series of a
+    spectrum table against the cycling period, normalized by its peak, with
+    the day, week, month and year marked. The figure is saved to path if
+    given, else shown; fig is a figure to draw on again (see
+    dispatch_optimization._figure)"""
+    keys = [column for column in table.columns if column not in ('frequency', 'period', 'power')]
+    groups = list(table.groupby(keys, sort=False))
+    columns = min(len(groups), max_columns)
+    rows = math.ceil(len(groups)/max_columns)
+    fig = _figure(fig, path)
+    axes = fig.subplots(rows, columns, sharey=True, squeeze=False)
+    for ax, (key, series) in zip(axes.ravel(), groups):
+        name = key[-1] if isinstance(key, tuple) else key
+        amplitude = np.sqrt(series.power)
+        ax.semilogx(series.period, amplitude/amplitude.max(), linewidth=2, label=name,
+                    color=(colors or {}).get(name))
+        ax.set(xlabel='cycling period (hours)')
+        # We add lines indicating day, week, month
+        for period, label in ((24, 'day'), (24*7, 'week'), (24*30, 'month'), (8760, '')):
+            ax.axvline(x=period, color='lightgrey', linestyle='--')
+            ax.text(period*1.1, 0.95, label, horizontalalignment='left', color='dimgrey', fontsize=9)
+        ax.legend()
+    _show(fig, path)
+    return fig
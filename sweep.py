@@ -0,0 +1,170 @@
+import dataclasses
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from solver import SolverConfig
+
+# Scenario sweeps solved in a pool of worker processes. Each worker builds its
+# scenario with build(**scenario), solves it and sends back a tidy table of
+# results, so only small DataFrames travel between processes.
+
+_build = None
+
+
+def init_worker(build, initializer=None):
+    """Keep build for worker_build in this process, after calling initializer()"""
+    # The build function (e.g. the scenario method of a ScenarioTemplate) is
+    # sent once per worker rather than once per scenario
+    global _build
+    if initializer is not None:
+        initializer()
+    _build = build
+
+
+def worker_build():
+    """build function given to init_worker or worker_pool in this process"""
+    return _build
+
+
+def worker_count(workers: int, solver_threads: int, tasks: int) -> int:
+    """Number of worker processes for tasks jobs solved with solver_threads
+    threads each: workers, by default as many as the cores allow, at most one
+    per job. Raises ValueError if workers*solver_threads exceeds the cores."""
+    cores = os.cpu_count() or 1
+    workers = workers or max(1, cores // solver_threads)
+    if workers*solver_threads > cores:
+        raise ValueError(f'{workers} workers with {solver_threads} solver threads exceed {cores} cores')
+    return max(1, min(workers, tasks))
+
+
+def worker_pool(build, workers: int, initializer=None, mp_context=None) -> ProcessPoolExecutor:
+    """Pool of workers processes, each running init_worker(build, initializer)"""
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(build, initializer),
+                               mp_context=mp_context)
+
+
+def scenario_name(scenario: dict) -> str:
+    """File name stem of a scenario, e.g. 'year=2019_co2=0.5'"""
+    return '_'.join(f'{key}={value}' for key, value in scenario.items()) or 'run'
+
+
+def _solve(scenario: dict, solver: SolverConfig, cache, log_directory: str = None, model_cache=None) -> pd.DataFrame:
+    model = _build(**scenario)
+    model.optimize(solver=solver, cache=cache, model_cache=model_cache)
+    if log_directory is not None:
+        model.run_log.info.update(scenario)
+        model.run_log.write(os.path.join(log_directory, f'{scenario_name(scenario)}.json'))
+    return results(model).assign(**scenario)
+
+
+def results(model) -> pd.DataFrame:
+    """
+    Tidy table (quantity, name, value) of a solved BusElectricity or
+    NetworkElectricity: production (MWh) and capacity (MW) of each generator,
+    production, capacity and curtailment of each carrier (from model.summary),
+    mean and load-weighted electricity price of each bus (EUR/MWh), CO2
+    emissions (tCO2), CO2 price of each global
+    constraint (EUR/tCO2), objective (EUR), total system cost of a rolling
+    horizon dispatch (EUR), electricity price (EUR/MWh),
+    solver statistics (wall time in seconds, iteration counts) and the wall
+    time of each phase of the run (s) with the peak resident memory during
+    the run (MB).
+    """
+    network = model.network
+    summary = model.summary()
+    carriers = summary['generators'].groupby('carrier', sort=False).sum()
+    quantities = {
+        'production': network.generators_t.p.sum(),
+        'capacity': network.generators.p_nom_opt,
+        'carrier_production': carriers.energy,
+        'carrier_capacity': carriers.capacity,
+        'curtailment': carriers.curtailment,
+        'co2': pd.Series({'co2': summary['co2']}),
+        'price': network.buses_t.marginal_price.mean(),
+        'load_price': summary['price'],
+        'co2_price': -network.global_constraints.mu,
+        'objective': pd.Series({'objective': model.objective}),
+    }
+    if hasattr(model, 'electricity_price'):
+        quantities['electricity_price'] = pd.Series({'electricity_price': model.electricity_price})
+    if hasattr(model, 'solve_stats'):
+        stats = {name: value for name, value in model.solve_stats.items()
+                 if name not in ('backend', 'status', 'condition', 'total_system_cost')}
+        quantities['solver'] = pd.Series(stats, dtype=float)
+        if 'total_system_cost' in model.solve_stats:  # Rolling horizon dispatch
+            quantities['total_system_cost'] = pd.Series({'total_system_cost': model.solve_stats['total_system_cost']})
+    if hasattr(model, 'run_log') and model.run_log.records:
+        quantities['timing'] = model.run_log.durations()
+        quantities['memory'] = pd.Series({'peak_rss': model.run_log.to_frame().peak_rss.max()})
+    return pd.concat([pd.DataFrame({'quantity': quantity, 'name': values.index, 'value': values.values})
+                      for quantity, values in quantities.items()], ignore_index=True)
+
+
+def run_sweep(build, scenarios: list[dict], workers: int = None, solver: SolverConfig = None,
+              solver_threads: int = 1, cache=None, log_directory: str = None, model_cache=None) -> pd.DataFrame:
+    """
+    Solve every scenario of the grid and gather the results in one tidy
+    DataFrame, with one column per scenario parameter. build(**scenario) must
+    return an object with an optimize method (BusElectricity, NetworkElectricity).
+    Scenarios run in workers processes, each solved with solver (HiGHS by
+    default) using solver_threads threads, with workers*solver_threads at most
+    the number of cores.
+    Solved networks are reused from cache (a SolveCache) and built models
+    from model_cache (a ModelCache) when given. With
+    log_directory, the run log of each scenario is written there as JSON
+    (see instrumentation.read_logs).
+    """
+    workers = worker_count(workers, solver_threads, len(scenarios))
+    solver = dataclasses.replace(solver or SolverConfig(), threads=solver_threads)
+
+    if workers == 1:
+        init_worker(build)
+        tables = [_solve(scenario, solver, cache, log_directory, model_cache) for scenario in scenarios]
+    else:
+        with worker_pool(build, workers) as executor:
+            tables = list(executor.map(_solve, scenarios, [solver]*len(scenarios),
+                                       [cache]*len(scenarios), [log_directory]*len(scenarios),
+                                       [model_cache]*len(scenarios)))
+    return pd.concat(tables, ignore_index=True)
+
+
+def _interval_changes(results: pd.DataFrame, parameter: str, quantities) -> pd.Series:
+    # Largest change of any value of quantities between consecutive solved
+    # values of parameter, relative to the largest magnitude of its quantity,
+    # indexed by the (left, right) ends of each interval
+    table = results[results.quantity.isin(quantities)].pivot_table(
+        index=parameter, columns=['quantity', 'name'], values='value', fill_value=0.)
+    scale = table.abs().max().groupby(level='quantity').max().replace(0., np.inf)
+    change = (table.diff().abs().iloc[1:]/scale.reindex(table.columns, level='quantity')).max(axis=1)
+    return pd.Series(change.to_numpy(), index=pd.MultiIndex.from_arrays(
+        [table.index[:-1], table.index[1:]], names=['left', 'right']))
+
+
+def run_adaptive_sweep(build, parameter: str, lower: float, upper: float, budget: int = 20, initial: int = 5,
+                       tolerance: float = 0.05, quantities=('carrier_capacity', 'load_price', 'co2_price'),
+                       min_width: float = None, fixed: dict = None, **kwargs) -> pd.DataFrame:
+    """
+    Sweep of one scenario parameter between lower and upper, refined where the
+    results change: initial evenly spaced values are solved, then every
+    interval over which a value of quantities (see results) changes by more
+    than tolerance, relative to the largest magnitude of its quantity, is
+    bisected, largest changes first, until no interval changes that much or
+    budget solves are done. Intervals narrower than min_width (1/1000 of the
+    range by default) are not split. fixed are scenario parameters shared by
+    every run; kwargs are passed to run_sweep, which solves each round of
+    bisections. Returns the tidy table of run_sweep for every solved value.
+    """
+    min_width = (upper - lower)/1000 if min_width is None else min_width
+    fixed = fixed or {}
+    values = list(np.linspace(lower, upper, min(initial, budget)))
+    tables = []
+    while values:
+        tables.append(run_sweep(build, [{**fixed, parameter: value} for value in values], **kwargs))
+        results = pd.concat(tables, ignore_index=True)
+        changes = _interval_changes(results, parameter, quantities)
+        changes = changes[(changes > tolerance)
+                          & (changes.index.get_level_values('right') - changes.index.get_level_values('left') > min_width)]
+        remaining = budget - results[parameter].nunique()
+        values = [(left + right)/2 for left, right in changes.sort_values(ascending=False).index[:remaining]]
+    return results
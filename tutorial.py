@@ -74,7 +74,7 @@ network.add('Generator', 'OCGT',
             marginal_cost=marginal_cost_OCGT)
 
 
-network.optimize(solver_name='gurobi')
+network.optimize(solver_name='highs')
 print(network.objective/1000000) #in 10^6 €
 print(network.objective/network.loads_t.p.sum()) # EUR/MWh
 print(network.generators.p_nom_opt) # in MW
@@ -1,7 +1,6 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import math
+from functools import lru_cache
 
 def annuity(n, r):
     """ Calculate the annuity factor for an asset with 
@@ -19,34 +18,67 @@ def cost_conversion(cost, year_from, year_to=2020, inflation=1.02):
     years = year_to - year_from
     return cost * (inflation ** years)
 
-def fourier_transform(list_data:list[pd.Series], colors:list[str]):
-    max_columns = 3
-    columns = min(len(list_data), max_columns)
-    rows = math.ceil(len(list_data)/max_columns)
-    fig, ax = plt.subplots(rows, columns, sharey=True)
-    for i, data  in enumerate(list_data):
-        column = i%max_columns 
-        row = math.ceil((i+1)/max_columns) - 1   
-        index = (row, column) if rows > 1 else column
-        t_sampling=1 # sampling rate, 1 data per hour
-        x = np.arange(1,8761, t_sampling) 
-        y = data
-        n = len(x)
-        y_fft = np.fft.fft(y)/n #n for normalization    
-        frq = np.arange(0,1/t_sampling,1/(t_sampling*n))        
-        period = np.array([1/f for f in frq]) 
-        ax[index].semilogx(period[1:n//2],
-                    abs(y_fft[1:n//2])/np.max(abs(y_fft[1:n//2])), 
-                    color=colors[i],
-                    linewidth=2, label=data.name)  
-        ax[index].set(xlabel='cycling period (hours)')
-        #We add lines indicating day, week, month
-        ax[index].axvline(x=24, color='lightgrey', linestyle='--')
-        ax[index].axvline(x=24*7, color='lightgrey', linestyle='--')
-        ax[index].axvline(x=24*30, color='lightgrey', linestyle='--')
-        ax[index].axvline(x=8760, color='lightgrey', linestyle='--') 
-        ax[index].text(26, 0.95, 'day', horizontalalignment='left', color='dimgrey', fontsize=9)
-        ax[index].text(24*7+20, 0.95, 'week', horizontalalignment='left', color='dimgrey', fontsize=9)
-        ax[index].text(24*30+20, 0.95, 'month', horizontalalignment='left', color='dimgrey', fontsize=9)
-        ax[index].legend()
-    plt.show()
\ No newline at end of file
+@lru_cache
+def hours_in_year(year: int) -> pd.DatetimeIndex:
+    """Hourly UTC timestamps of a year, without the 29th of February so that
+    every year has 8760 hours"""
+    hours = pd.date_range(f'{year}-01-01 00:00Z', f'{year}-12-31 23:00Z', freq='h')
+    return hours[~((hours.month == 2) & (hours.day == 29))]
+
+def great_circle_distance(lat0, lon0, lat1, lon1, radius: float = 6371.):
+    """ Great-circle distance in km between points given in degrees (haversine
+    formula), element-wise over broadcast arrays """
+    lat0, lon0, lat1, lon1 = map(np.radians, (lat0, lon0, lat1, lon1))
+    a = np.sin((lat1 - lat0)/2)**2 + np.cos(lat0)*np.cos(lat1)*np.sin((lon1 - lon0)/2)**2
+    return 2*radius*np.arcsin(np.sqrt(a))
+
+def nearest_pairs(lat: np.ndarray, lon: np.ndarray, k: int):
+    """ Pairs (i, j), i < j, of the points each joined to its k nearest
+    neighbours. Returns the pairs and their great-circle distance in km """
+    distance = great_circle_distance(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
+    np.fill_diagonal(distance, np.inf)
+    nearest = np.argsort(distance, axis=1)[:, :k]
+    pairs = np.sort(np.column_stack([np.repeat(np.arange(len(lat)), nearest.shape[1]), nearest.ravel()]), axis=1)
+    pairs = np.unique(pairs, axis=0)
+    return pairs, distance[pairs[:, 0], pairs[:, 1]]
+
+def kmeans(X: np.ndarray, k: int, iterations: int = 100, seed: int = 0):
+    """ k-means clustering of the rows of X, with k-means++ initialisation.
+    Returns the label of each row and the centers """
+    rng = np.random.default_rng(seed)
+    centers = X[[rng.integers(len(X))]]
+    for _ in range(1, k):
+        distance = ((X[:, None, :] - centers[None, :, :])**2).sum(axis=2).min(axis=1)
+        p = distance/distance.sum() if distance.sum() > 0 else None
+        centers = np.vstack([centers, X[rng.choice(len(X), p=p)]])
+    for _ in range(iterations):
+        labels = ((X[:, None, :] - centers[None, :, :])**2).sum(axis=2).argmin(axis=1)
+        new_centers = np.array([X[labels == i].mean(axis=0) if (labels == i).any() else centers[i]
+                                for i in range(k)])
+        if np.allclose(new_centers, centers):
+            break
+        centers = new_centers
+    return labels, centers
+
+def kmedoids(X: np.ndarray, k: int, iterations: int = 100, seed: int = 0):
+    """ k-medoids clustering of the rows of X, starting from k-means.
+    Returns the label of each row and the row index of each medoid """
+    labels, centers = kmeans(X, k, seed=seed)
+    squared = (X**2).sum(axis=1)
+    distance = np.sqrt(np.maximum(squared[:, None] + squared[None, :] - 2*X @ X.T, 0))
+    medoids = []
+    for row in ((X[:, None, :] - centers[None, :, :])**2).sum(axis=2).argmin(axis=0):
+        # A row nearest to two centers would leave a medoid without members:
+        # the repeat is replaced by the row farthest from the medoids
+        if row in medoids:
+            row = distance[:, medoids].min(axis=1).argmax()
+        medoids.append(int(row))
+    medoids = np.array(medoids)
+    for _ in range(iterations):
+        labels = distance[:, medoids].argmin(axis=1)
+        new_medoids = np.array([np.flatnonzero(labels == i)[distance[np.ix_(labels == i, labels == i)].sum(axis=0).argmin()]
+                                if (labels == i).any() else medoids[i] for i in range(k)])
+        if np.array_equal(new_medoids, medoids):
+            break
+        medoids = new_medoids
+    return distance[:, medoids].argmin(axis=1), medoids
@@ -1,40 +1,63 @@
 from dispatch_optimization import BusElectricity
+from profiles import load_cube
+from sweep import run_sweep
+from solve_cache import SolveCache
+from benders import BendersDecomposition
+from figures import export_figures
 import param
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.gridspec import GridSpec
 import pypsa
+from functools import partial
 
-years = np.arange(start=1980, stop=2015, step=1)
-df = pd.DataFrame(index=[key for key, df in param.technologies_france.items()])
-elec_prices = []
 
-for year in years:
-    france_net = BusElectricity('FRA', year, technologies=param.technologies_france, network=pypsa.Network())
+def build_year(year, profiles):
+    france_net = BusElectricity('FRA', year, technologies=param.technologies_france, network=pypsa.Network(), profiles=profiles)
     #france_net.add_co2_constraints(param.co2_limit_2019)
-    france_net.optimize() 
-    df[year] = france_net.return_capacity_mix()/1000
-    elec_prices.append(france_net.electricity_price)
+    return france_net
+
+
+years = np.arange(start=1980, stop=2015, step=1)
+# Years covered by the hydro inflow record use their own inflow
+param.hydro_year_matched = True
+
+if __name__ == '__main__':
+    profiles = load_cube()
+    # Solved years are kept in results/cache, so only new inputs are solved again
+    results = run_sweep(partial(build_year, profiles=profiles), [{'year': year} for year in years],
+                        cache=SolveCache())
+    df = results[results.quantity == 'capacity'].pivot(index='year', columns='name', values='value')
+    df = df[list(param.technologies_france)]/1000
+    elec_prices = list(results[results.quantity == 'electricity_price'].set_index('year').value[years])
     print(elec_prices)
+    # Capacity mix of every weather year, saved to results/figures
+    export_figures(partial(build_year, profiles=profiles), [{'year': year} for year in years],
+                   {'mix': ('plot_pie', {})}, cache=SolveCache())
+
+    # One capacity mix for all the weather years, against the spread of the yearly optima
+    benders = BendersDecomposition(partial(build_year, profiles=profiles), years)
+    robust = benders.run().droplevel('component')[df.columns]/1000
+    print(benders.history)
 
-df = df.T
-fig = plt.figure()
-gs = GridSpec(1, 2, width_ratios=[6, 1])
-ax1 = fig.add_subplot(gs[0])
-ax2 = fig.add_subplot(gs[1])
-for n, col in enumerate(df.columns):
-    bplot = ax1.boxplot(df[col], positions=[n+1], patch_artist=True, tick_labels=[str(col)], showmeans=True)
+    fig = plt.figure()
+    gs = GridSpec(1, 2, width_ratios=[6, 1])
+    ax1 = fig.add_subplot(gs[0])
+    ax2 = fig.add_subplot(gs[1])
+    for n, col in enumerate(df.columns):
+        bplot = ax1.boxplot(df[col], positions=[n+1], patch_artist=True, tick_labels=[str(col)], showmeans=True)
+        for patch in bplot['boxes']:
+            patch.set_facecolor(param.colors[col])
+    ax1.scatter(range(1, len(df.columns)+1), robust, marker='x', color='black', zorder=3, label='Robust mix')
+    ax1.legend(fancybox=True, loc='best')
+    bplot = ax2.boxplot(elec_prices, patch_artist=True, showmeans=True)
     for patch in bplot['boxes']:
-        patch.set_facecolor(param.colors[col])
-bplot = ax2.boxplot(elec_prices, patch_artist=True, showmeans=True)
-for patch in bplot['boxes']:
-        patch.set_facecolor(param.colors['elec'])
-
-ax1.set(ylabel='Capacity installed (GW)')
-ax1.grid(linewidth='0.4', linestyle='--')
-ax2.set(ylabel='Electricity price (€/MWh)', ylim=(0, max(elec_prices)+2))
-ax2.grid(linewidth='0.4', linestyle='--')
-plt.show()
-# df.describe().to_csv('stats_capacity.csv')
-# df.to_csv('capacity.csv')
\ No newline at end of file
+            patch.set_facecolor(param.colors['elec'])
+
+    ax1.set(ylabel='Capacity installed (GW)')
+    ax1.grid(linewidth='0.4', linestyle='--')
+    ax2.set(ylabel='Electricity price (€/MWh)', ylim=(0, max(elec_prices)+2))
+    ax2.grid(linewidth='0.4', linestyle='--')
+    plt.show()
+    # df.describe().to_csv('stats_capacity.csv')
+    # df.to_csv('capacity.csv')